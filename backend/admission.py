@@ -0,0 +1,102 @@
+# admission.py
+# Global admission control for LLM calls. At most MAX_CONCURRENT_LLM_CALLS provider requests (every
+# stream, extraction call and hedge attempt counts) are in flight across all flows; the rest wait in
+# a priority queue, so a burst of new chats can't starve threads that are about to be summarized,
+# or push every conversation into the providers' rate limits at the same time.
+# run_flow sets the turn's priority (routing.flow_priority) once, the router takes a slot per request.
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import time
+
+from metrics import LLM_ADMISSION_WAIT
+from routing import PRIORITY_CONTINUE, PRIORITY_NEW_THREAD, PRIORITY_SUMMARIZE
+
+# LLM requests in flight at once, across providers (0 disables admission control)
+MAX_CONCURRENT_LLM_CALLS = int(os.environ.get("MAX_CONCURRENT_LLM_CALLS", "64"))
+# Head start per priority level, in seconds of queueing. A summarize turn overtakes new threads that
+# queued up to 2x this earlier, but a new thread that has waited that long still goes first,
+# so low priorities are delayed under overload rather than starved.
+ADMISSION_PRIORITY_STEP = float(os.environ.get("ADMISSION_PRIORITY_STEP", "5"))
+
+PRIORITY_NAMES = {PRIORITY_SUMMARIZE: "summarize", PRIORITY_CONTINUE: "continue", PRIORITY_NEW_THREAD: "new_thread"}
+
+# The running turn's priority and the metadata its queue wait is reported in.
+# Inherited by the flow task and the tasks it spawns (speculative generation, hedges).
+_current_turn = contextvars.ContextVar("admission_turn", default=None)
+
+
+def start_turn(priority, metadata):
+    """
+    Called by run_flow before the flow task is created. The flow's LLM requests queue at `priority`,
+    and their total wait is kept in metadata["queue_wait_ms"] (sent in the stream's metadata event).
+    """
+    metadata["queue_wait_ms"] = 0
+    _current_turn.set((priority, metadata))
+
+
+class AdmissionScheduler:
+    def __init__(self, limit=MAX_CONCURRENT_LLM_CALLS, priority_step=ADMISSION_PRIORITY_STEP):
+        self.limit = limit
+        self.priority_step = priority_step
+        self.active = 0
+        # (deadline, seq, future); cancelled waiters stay in the heap and are skipped on release
+        self._waiters = []
+        self._seq = itertools.count()
+        self.admitted_total = 0
+        self.queued_total = 0
+
+    def queued(self):
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def acquire(self):
+        """Wait for a slot at the current turn's priority, returns the seconds spent queued."""
+        priority, metadata = _current_turn.get() or (PRIORITY_CONTINUE, None)
+        waited = await self._acquire(priority)
+        LLM_ADMISSION_WAIT.observe(waited, priority=PRIORITY_NAMES.get(priority, priority))
+        if metadata is not None and waited:
+            metadata["queue_wait_ms"] = metadata.get("queue_wait_ms", 0) + round(waited * 1000)
+        return waited
+
+    async def _acquire(self, priority):
+        # Below the limit the heap only holds cancelled waiters (a release hands live ones the slot)
+        if self.limit <= 0 or self.active < self.limit:
+            self.active += 1
+            self.admitted_total += 1
+            return 0.0
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (started + priority * self.priority_step, next(self._seq), future))
+        self.queued_total += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Handed a slot just as we were cancelled, pass it on
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        self.admitted_total += 1
+        return time.monotonic() - started
+
+    def release(self):
+        # The slot goes straight to the next waiter, so `active` only drops when nobody is queued
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": self.queued(),
+            "admitted_total": self.admitted_total,
+            "queued_total": self.queued_total,
+        }
+
+
+admission = AdmissionScheduler()
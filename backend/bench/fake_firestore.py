@@ -0,0 +1,158 @@
+# bench/fake_firestore.py
+# In-memory stand-in for firebase_config.db, covering the calls persistence.py makes.
+# FAKE_FIRESTORE_LATENCY_MS adds a blocking sleep to every read/write, like a slow Firestore round trip,
+# so benchmarks can check that a stalled Firestore doesn't stall the event loop.
+import os
+import sys
+import threading
+import time
+import types
+import uuid
+
+FAKE_FIRESTORE_LATENCY_MS = float(os.environ.get("FAKE_FIRESTORE_LATENCY_MS", "0"))
+
+SEED_TOPICS = [
+    {"topic": "Construction noise", "summary": "Noise from construction sites at night", "imageURL": ""},
+    {"topic": "Public transport", "summary": "Crowded and late buses", "imageURL": ""},
+    {"topic": "Hawker centre hygiene", "summary": "Dirty tables and pests", "imageURL": ""},
+]
+
+
+def _stall():
+    if FAKE_FIRESTORE_LATENCY_MS:
+        time.sleep(FAKE_FIRESTORE_LATENCY_MS / 1000)
+
+
+class FakeDocument:
+    def __init__(self, doc_id, data, collection=None):
+        self.id = doc_id
+        self._data = data
+        self.reference = FakeDocumentRef(collection, doc_id)
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakeDocumentRef:
+    def __init__(self, collection, doc_id):
+        self.collection = collection
+        self.id = doc_id
+
+    def set(self, data):
+        _stall()
+        self.collection._write(self.id, data)
+
+    def update(self, data):
+        _stall()
+        self.collection._write(self.id, {**self.collection._docs.get(self.id, {}), **data})
+
+    def delete(self):
+        _stall()
+        self.collection._write(self.id, None)
+
+
+class FakeQuery:
+    # Only the equality filters persistence.py uses
+    def __init__(self, collection, field_filter):
+        self.collection = collection
+        self.field_filter = field_filter
+
+    def stream(self):
+        f = self.field_filter
+        return [doc for doc in self.collection.stream() if f.op_string == "==" and doc.to_dict().get(f.field_path) == f.value]
+
+
+class FakeBatch:
+    def __init__(self):
+        self._ops = []
+
+    def update(self, ref, data):
+        self._ops.append(lambda: ref.update(data))
+
+    def delete(self, ref):
+        self._ops.append(ref.delete)
+
+    def commit(self):
+        for op in self._ops:
+            op()
+        self._ops = []
+
+
+class FakeWatch:
+    def __init__(self, collection, callback):
+        self.collection = collection
+        self.callback = callback
+
+    def unsubscribe(self):
+        with self.collection._lock:
+            if self in self.collection._watches:
+                self.collection._watches.remove(self)
+
+
+class FakeCollection:
+    def __init__(self, docs=()):
+        self._docs = {uuid.uuid4().hex: dict(doc) for doc in docs}
+        self._watches = []
+        self._lock = threading.Lock()
+        self.reads = 0
+        self.writes = 0
+
+    def _snapshot(self):
+        return [FakeDocument(doc_id, data, self) for doc_id, data in self._docs.items()]
+
+    def _write(self, doc_id, data):
+        # data=None deletes
+        with self._lock:
+            if data is None:
+                self._docs.pop(doc_id, None)
+            else:
+                self._docs[doc_id] = dict(data)
+            self.writes += 1
+            snapshot = self._snapshot()
+            watches = list(self._watches)
+        for watch in watches:
+            watch.callback(snapshot, [], None)
+
+    def stream(self):
+        _stall()
+        with self._lock:
+            self.reads += 1
+            return self._snapshot()
+
+    def document(self, doc_id=None):
+        return FakeDocumentRef(self, doc_id or uuid.uuid4().hex)
+
+    def where(self, filter):
+        return FakeQuery(self, filter)
+
+    def on_snapshot(self, callback):
+        watch = FakeWatch(self, callback)
+        with self._lock:
+            self._watches.append(watch)
+            snapshot = self._snapshot()
+        # Firestore delivers the initial state straight away, then every change
+        callback(snapshot, [], None)
+        return watch
+
+
+class FakeFirestore:
+    def __init__(self):
+        self._collections = {"topics": FakeCollection(SEED_TOPICS)}
+
+    def collection(self, name):
+        return self._collections.setdefault(name, FakeCollection())
+
+    def batch(self):
+        return FakeBatch()
+
+    def stats(self):
+        return {name: {"docs": len(c._docs), "reads": c.reads, "writes": c.writes} for name, c in self._collections.items()}
+
+
+def install():
+    """Register a fake firebase_config module, must run before anything imports persistence/server."""
+    module = types.ModuleType("firebase_config")
+    module.db = FakeFirestore()
+    module.get_db = lambda: module.db
+    sys.modules["firebase_config"] = module
+    return module.db
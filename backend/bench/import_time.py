@@ -0,0 +1,83 @@
+# bench/import_time.py
+# Import-time regression check for the app (`python -X importtime -c "import server"`).
+# Fails (exit 1) if a provider SDK / Firestore module is imported eagerly again, or if the median
+# import time exceeds the tracked baseline in import_baseline.json by more than its tolerance.
+#
+#   python bench/import_time.py               # check against the baseline
+#   python bench/import_time.py --save        # record this machine's timing as the new baseline
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+BASELINE_PATH = os.path.join(BENCH_DIR, "import_baseline.json")
+
+# Only ever imported on first use (see llm_clients.py, firebase_config.py, utils.py)
+LAZY_MODULES = ("openai", "anthropic", "firebase_admin", "google.cloud.firestore_v1", "requests", "tiktoken")
+
+
+def import_profile(module="server"):
+    """One cold interpreter importing `module` -> {module_name: (self_us, cumulative_us)}."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    )
+    profile = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if self_us.strip().isdigit():
+            profile[name.strip()] = (int(self_us), int(cumulative_us))
+    return profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check server.py import time against the tracked baseline")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="slowest modules (self time) to list")
+    parser.add_argument("--save", action="store_true", help="write this run's median as the new baseline")
+    args = parser.parse_args()
+
+    # First run compiles bytecode, don't count it
+    import_profile()
+    profiles = [import_profile() for _ in range(args.runs)]
+    median_ms = statistics.median(profile["server"][1] for profile in profiles) / 1000
+
+    last = profiles[-1]
+    print(f"import server: median {median_ms:.0f}ms over {args.runs} runs, {len(last)} modules")
+    for name, (self_us, _) in sorted(last.items(), key=lambda item: item[1][0], reverse=True)[:args.top]:
+        print(f"  {self_us / 1000:8.1f}ms  {name}")
+
+    if args.save:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({"server_ms": round(median_ms), "tolerance": 2.0}, f, indent=2)
+            f.write("\n")
+        print(f"Saved baseline to {BASELINE_PATH}")
+        return 0
+
+    failures = []
+    eager = [name for name in LAZY_MODULES if name in last]
+    if eager:
+        failures.append(f"imported eagerly: {', '.join(eager)}")
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+        limit = baseline["server_ms"] * baseline["tolerance"]
+        print(f"baseline {baseline['server_ms']}ms, limit {limit:.0f}ms")
+        if median_ms > limit:
+            failures.append(f"{median_ms:.0f}ms is over the {limit:.0f}ms limit")
+
+    for failure in failures:
+        print(f"FAIL  {failure}")
+    if not failures:
+        print("PASS")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+# bench/mock_llm.py
+# Local OpenAI-compatible server standing in for OpenRouter during benchmarks.
+# Streamed completions (generate / summarize) emit --tokens tokens after --ttft-ms, --token-delay-ms apart.
+# Non-streamed completions (extraction) return the JSON the extraction node expects, picked
+# deterministically from the prompt so replayed turns get the same answer.
+#
+#   python bench/mock_llm.py --port 8900 --ttft-ms 300 --token-delay-ms 20
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+TOPICS = ["Construction noise", "Public transport", "Hawker centre hygiene"]
+LOCATIONS = ["Joo Chiat", "Boon Lay", "Bishan", "Tampines"]
+WORDS = "Could you tell me more about when this happens and how it affects you".split()
+
+
+class MockConfig:
+    def __init__(self, ttft_ms=300.0, token_delay_ms=20.0, tokens=40, extraction_ms=400.0, complete_rate=0.3, new_topic_rate=0.05, fail_rate=0.0, fail_status=503):
+        self.ttft_ms = ttft_ms
+        self.token_delay_ms = token_delay_ms
+        self.tokens = tokens
+        self.extraction_ms = extraction_ms
+        # Share of extractions scored 5 (complete), which sends the turn to the summarizer
+        self.complete_rate = complete_rate
+        # Share of extractions inventing a topic, which writes a new topic document
+        self.new_topic_rate = new_topic_rate
+        # Share of requests answered with fail_status instead, for exercising provider failover
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+
+
+def _rng(messages):
+    digest = hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).digest()
+    return random.Random(digest)
+
+
+def extraction_json(messages, config):
+    rng = _rng(messages)
+    topic = rng.choice(TOPICS)
+    if rng.random() < config.new_topic_rate:
+        topic = f"Bench topic {rng.randrange(10_000)}"
+    quality = 5 if rng.random() < config.complete_rate else rng.choice([2, 3, 4])
+    return json.dumps({
+        "complaint_topic": topic,
+        "complaint_location": rng.choice(LOCATIONS),
+        "complaint_summary": f"Citizen reports an issue with {topic.lower()}.",
+        "complaint_quality": quality,
+        "conversation_summary": f"User complained about {topic.lower()}, assistant asked for details.",
+    })
+
+
+def create_app(config):
+    app = FastAPI()
+    stats = {"stream_requests": 0, "completion_requests": 0, "active_streams": 0, "peak_streams": 0, "failed_requests": 0}
+
+    def _chunk(completion_id, model, delta, finish_reason=None, usage=None):
+        choices = [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        body = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model, "choices": choices}
+        if usage:
+            body["usage"] = usage
+        return f"data: {json.dumps(body)}\n\n"
+
+    async def _stream(completion_id, model, include_usage):
+        stats["active_streams"] += 1
+        stats["peak_streams"] = max(stats["peak_streams"], stats["active_streams"])
+        try:
+            await asyncio.sleep(config.ttft_ms / 1000)
+            for i in range(config.tokens):
+                if i:
+                    await asyncio.sleep(config.token_delay_ms / 1000)
+                yield _chunk(completion_id, model, {"content": WORDS[i % len(WORDS)] + " "})
+            yield _chunk(completion_id, model, {}, finish_reason="stop")
+            if include_usage:
+                yield _chunk(completion_id, model, {}, usage={"prompt_tokens": 200, "completion_tokens": config.tokens, "total_tokens": 200 + config.tokens})
+            yield "data: [DONE]\n\n"
+        finally:
+            stats["active_streams"] -= 1
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "mock")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        if config.fail_rate and random.random() < config.fail_rate:
+            stats["failed_requests"] += 1
+            return JSONResponse({"error": {"message": "mock failure", "code": config.fail_status}}, status_code=config.fail_status)
+        if body.get("stream"):
+            stats["stream_requests"] += 1
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            return StreamingResponse(_stream(completion_id, model, include_usage), media_type="text/event-stream")
+
+        stats["completion_requests"] += 1
+        await asyncio.sleep(config.extraction_ms / 1000)
+        content = extraction_json(body.get("messages", []), config)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 600, "completion_tokens": 80, "total_tokens": 680},
+        }
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible LLM server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--ttft-ms", type=float, default=300.0)
+    parser.add_argument("--token-delay-ms", type=float, default=20.0)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--extraction-ms", type=float, default=400.0)
+    parser.add_argument("--complete-rate", type=float, default=0.3)
+    parser.add_argument("--new-topic-rate", type=float, default=0.05)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--fail-status", type=int, default=503)
+    args = parser.parse_args()
+
+    config = MockConfig(
+        args.ttft_ms, args.token_delay_ms, args.tokens, args.extraction_ms, args.complete_rate, args.new_topic_rate,
+        args.fail_rate, args.fail_status,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning", backlog=4096)
+
+
+if __name__ == "__main__":
+    main()
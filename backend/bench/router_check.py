@@ -0,0 +1,151 @@
+# bench/router_check.py
+# Exercises llm_router against local mock providers (bench/mock_llm.py apps served in-process):
+# hedging a slow provider, failing over from a broken one, opening its circuit breaker,
+# and per-provider concurrency limits. Exits non-zero if any check fails.
+#
+#   python bench/router_check.py
+import asyncio
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Fail over on the first error instead of letting the SDK retry
+os.environ.setdefault("LLM_MAX_RETRIES", "0")
+
+import uvicorn  # noqa: E402
+
+from mock_llm import MockConfig, create_app  # noqa: E402
+from llm_router import CircuitBreaker, LLMRouter, Provider  # noqa: E402
+from utils import call_llm_async, stream_llm_async  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "The piling works near my flat go on past 10pm"}]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class MockServer:
+    def __init__(self, name, config):
+        self.name = name
+        self.app = create_app(config)
+        self.port = free_port()
+        self.server = uvicorn.Server(uvicorn.Config(self.app, port=self.port, log_level="warning"))
+        self.task = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    async def start(self):
+        self.task = asyncio.create_task(self.server.serve())
+        while not self.server.started:
+            await asyncio.sleep(0.01)
+
+    async def stats(self):
+        route = next(route for route in self.app.routes if getattr(route, "path", "") == "/stats")
+        return await route.endpoint()
+
+    async def stop(self):
+        self.server.should_exit = True
+        await self.task
+
+    def provider(self, **kwargs):
+        return Provider(self.name, self.base_url, "bench", **kwargs)
+
+
+async def collect(router):
+    started = time.perf_counter()
+    text = "".join([chunk async for chunk in stream_llm_async(MESSAGES, router=router)])
+    return text, time.perf_counter() - started
+
+
+async def main():
+    fast = MockServer("fast", MockConfig(ttft_ms=50, token_delay_ms=1, tokens=10, extraction_ms=50))
+    slow = MockServer("slow", MockConfig(ttft_ms=3000, token_delay_ms=1, tokens=10, extraction_ms=3000))
+    broken = MockServer("broken", MockConfig(fail_rate=1.0))
+    for server in (fast, slow, broken):
+        await server.start()
+
+    results = []
+
+    def check(name, ok, detail):
+        results.append(ok)
+        print(f"{'PASS' if ok else 'FAIL'}  {name}: {detail}")
+
+    try:
+        # Slow first provider: the fast one is fired after the TTFT deadline and wins, the slow stream is cancelled
+        router = LLMRouter([slow.provider(), fast.provider()], hedge_ttft_ms=300, hedge_call_ms=300)
+        text, elapsed = await collect(router)
+        await asyncio.sleep(0.1)
+        slow_stats = await slow.stats()
+        check("stream hedge", bool(text) and elapsed < 1.5 and slow_stats["active_streams"] == 0,
+              f"{elapsed * 1000:.0f}ms, slow provider streams still open: {slow_stats['active_streams']}")
+
+        started = time.perf_counter()
+        content = await call_llm_async("extract", router=router)
+        elapsed = time.perf_counter() - started
+        check("call hedge", bool(content) and elapsed < 1.5, f"{elapsed * 1000:.0f}ms")
+
+        # Broken first provider: fail over straight away, breaker opens after 3 failures and it stops being tried
+        router = LLMRouter([broken.provider(breaker=CircuitBreaker(failure_threshold=3, reset_after=60)), fast.provider()])
+        for _ in range(5):
+            text, elapsed = await collect(router)
+        broken_stats = await broken.stats()
+        state = router.providers[0].breaker.state
+        check("failover + breaker", bool(text) and state == "open" and broken_stats["failed_requests"] == 3,
+              f"breaker {state}, broken provider hit {broken_stats['failed_requests']} times for 5 calls")
+
+        # Half-open: after the reset window one trial goes through, and a failure re-opens it
+        router.providers[0].breaker.reset_after = 0.2
+        await asyncio.sleep(0.3)
+        await collect(router)
+        broken_stats = await broken.stats()
+        check("half-open trial", broken_stats["failed_requests"] == 4 and router.providers[0].breaker.state == "open",
+              f"broken provider hit {broken_stats['failed_requests']} times, breaker {router.providers[0].breaker.state}")
+
+        # Half-open trial closed early by the consumer (aclose after the first chunk) frees the trial,
+        # so the provider isn't stuck behind "circuit open" for good
+        router = LLMRouter([fast.provider(breaker=CircuitBreaker(failure_threshold=1, reset_after=0.1))])
+        breaker = router.providers[0].breaker
+        breaker.record_failure()
+        await asyncio.sleep(0.2)
+        stream = stream_llm_async(MESSAGES, router=router)
+        await stream.__anext__()
+        await stream.aclose()
+        try:
+            text, _ = await collect(router)
+        except Exception as e:
+            text = repr(e)[:120]
+        check("half-open early close", breaker.state == "closed" and not text.startswith("LLMUnavailable"),
+              f"breaker {breaker.state} after the early close, next stream: {text[:40]!r}")
+
+        # Concurrency limit: 6 streams through a provider capped at 2 never run more than 2 at once
+        limited = MockServer("limited", MockConfig(ttft_ms=100, token_delay_ms=1, tokens=5))
+        await limited.start()
+        router = LLMRouter([limited.provider(max_concurrency=2)])
+        await asyncio.gather(*(collect(router) for _ in range(6)))
+        peak = (await limited.stats())["peak_streams"]
+        await limited.stop()
+        check("concurrency limit", peak <= 2, f"peak concurrent streams {peak}")
+
+        # Everything broken: a clear error rather than a hang
+        router = LLMRouter([broken.provider(breaker=CircuitBreaker(failure_threshold=1))])
+        try:
+            await collect(router)
+            check("all providers down", False, "no error raised")
+        except Exception as e:
+            check("all providers down", type(e).__name__ == "LLMUnavailable", repr(e)[:120])
+    finally:
+        for server in (fast, slow, broken):
+            await server.stop()
+
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,313 @@
+# bench/run.py
+# Offline load benchmark: starts the mock LLM (mock_llm.py) and the chat server on fake Firestore
+# (serve.py) as subprocesses, then drives N concurrent simulated conversations through POST /api/chat
+# and the SSE stream, the same way the frontend does. No OpenRouter or Firestore access is needed.
+#
+#   python bench/run.py                                  # 50 conversations x 3 turns
+#   python bench/run.py --conversations 500 --turns 2 --ttft-ms 800
+#   python bench/run.py --scenario concurrency           # 2k concurrent chats, p99 latency
+#   python bench/run.py --scenario all --json results.json
+#
+# Reports turns/sec, TTFT and turn latency p50/p95/p99, SSE frames/sec, server CPU per stream,
+# SSE connection-seconds and the server's event-loop lag.
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CONVERSATIONS_PER_POOL = 10
+
+COMPLETE_THREAD = {"topic": "Construction noise", "summary": "Piling works past 10pm", "location": "Bishan", "quality": 5}
+
+# Named presets. Each is a list of runs: (label, option overrides, extra server env)
+SCENARIOS = {
+    "chat": [("chat", {}, {})],
+    # Many chats at once against the task registry and broker
+    "concurrency": [("2k concurrent chats", {"conversations": 2000, "turns": 1}, {"MAX_ACTIVE_TASKS": "4000"})],
+    # Every Firestore call blocks for 500ms, new topics are written often; loop lag should stay flat
+    "firestore-stall": [("firestore stall 500ms", {"conversations": 200, "turns": 2, "new_topic_rate": 0.5}, {"FAKE_FIRESTORE_LATENCY_MS": "500"})],
+    # Long fast streams, to measure SSE frames/sec and server CPU per stream
+    "stream-cpu": [("long streams", {"conversations": 200, "turns": 1, "tokens": 400, "token_delay_ms": 5}, {})],
+    # Completed threads only, served from the canned rejection
+    "rejection-flood": [("rejection flood", {"conversations": 2000, "turns": 1, "complete_threads": True}, {"MAX_ACTIVE_TASKS": "4000"})],
+    # Same load with logging at INFO vs off, compare loop lag
+    "logging": [
+        ("logging on", {"conversations": 500, "turns": 1}, {"LOG_LEVEL": "INFO"}),
+        ("logging off", {"conversations": 500, "turns": 1}, {"LOG_LEVEL": "CRITICAL"}),
+    ],
+    # A burst of new chats on top of ongoing ones, with and without admission control;
+    # compare follow-up turn latency and the queue wait reported in the metadata event
+    "overload": [
+        ("overload, no admission limit", {"conversations": 500, "turns": 3, "ramp_s": 5}, {"MAX_CONCURRENT_LLM_CALLS": "0"}),
+        ("overload, 32 LLM calls", {"conversations": 500, "turns": 3, "ramp_s": 5}, {"MAX_CONCURRENT_LLM_CALLS": "32"}),
+    ],
+}
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def ms(value):
+    return None if value is None else round(value * 1000, 1)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def raise_fd_limit():
+    # Every concurrent chat holds an SSE connection (plus the server's LLM connection)
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+async def wait_ready(url, proc, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {proc.returncode}")
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+class Results:
+    def __init__(self):
+        self.turns = 0
+        self.errors = 0
+        self.rejected = 0
+        self.frames = 0
+        self.ttft = []
+        self.latency = []
+        # Turns after the first in their conversation (admitted ahead of new threads)
+        self.followup_latency = []
+        self.queue_wait = []
+        self.connection_seconds = 0.0
+
+
+async def run_turn(client, messages, thread_meta, results, followup=False):
+    started = time.perf_counter()
+    response = await client.post("/api/chat", json={"messages": messages, "threadMetaData": thread_meta})
+    if response.status_code == 429:
+        results.rejected += 1
+        return None
+    response.raise_for_status()
+    task_id = response.json()["task_id"]
+
+    reply = ""
+    metadata = None
+    opened = time.perf_counter()
+    try:
+        async with client.stream("GET", f"/api/chat/stream/{task_id}") as stream:
+            stream.raise_for_status()
+            async for line in stream.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = json.loads(line[5:])
+                if "content" in payload:
+                    if not reply:
+                        results.ttft.append(time.perf_counter() - started)
+                    reply += payload["content"]
+                    results.frames += 1
+                elif payload.get("type") == "metadata":
+                    metadata = payload["threadMetaData"]
+                elif payload.get("done"):
+                    break
+    finally:
+        results.connection_seconds += time.perf_counter() - opened
+    results.latency.append(time.perf_counter() - started)
+    if followup:
+        results.followup_latency.append(results.latency[-1])
+    if metadata and "queue_wait_ms" in metadata:
+        results.queue_wait.append(metadata["queue_wait_ms"] / 1000)
+    results.turns += 1
+    return reply, metadata
+
+
+async def conversation(client, index, options, results):
+    messages = []
+    thread_meta = dict(COMPLETE_THREAD) if options.complete_threads else {}
+    for turn in range(options.turns):
+        messages.append({"role": "user", "content": f"Complaint {index}, turn {turn}: the piling works near my flat go on past 10pm"})
+        try:
+            outcome = await run_turn(client, messages, thread_meta, results, followup=turn > 0)
+        except (httpx.HTTPError, json.JSONDecodeError):
+            results.errors += 1
+            return
+        if outcome is None:
+            return
+        reply, metadata = outcome
+        messages.append({"role": "assistant", "content": reply})
+        if metadata:
+            # What the frontend keeps in localStorage and sends back with the next turn
+            thread_meta = {
+                "topic": metadata.get("complaint_topic") or "",
+                "summary": metadata.get("complaint_summary") or "",
+                "location": metadata.get("complaint_location") or "",
+                "quality": metadata.get("complaint_quality") or 0,
+                "conversationSummary": metadata.get("conversation_summary") or "",
+                "extractedMessageCount": metadata.get("extracted_message_count") or 0,
+                "extractedPrefixHash": metadata.get("extracted_prefix_hash") or "",
+            }
+
+
+def start_processes(options, env_overrides):
+    llm_port, app_port = free_port(), free_port()
+    mock = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, "mock_llm.py"), "--port", str(llm_port),
+        "--ttft-ms", str(options.ttft_ms), "--token-delay-ms", str(options.token_delay_ms), "--tokens", str(options.tokens),
+        "--extraction-ms", str(options.extraction_ms), "--complete-rate", str(options.complete_rate),
+        "--new-topic-rate", str(options.new_topic_rate),
+    ])
+    env = dict(os.environ)
+    env.update({
+        "LLM_BASE_URL": f"http://127.0.0.1:{llm_port}/v1",
+        "QWEN_30B": "bench",
+        "LOG_LEVEL": "WARNING",
+        "LLM_MAX_CONNECTIONS": "4000",
+        "LLM_MAX_KEEPALIVE_CONNECTIONS": "1000",
+    })
+    env.update(env_overrides)
+    app = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "serve.py"), "--port", str(app_port)], env=env)
+    return mock, app, llm_port, app_port
+
+
+async def run_once(label, options, env_overrides):
+    mock, app, llm_port, app_port = start_processes(options, env_overrides)
+    base_url = f"http://127.0.0.1:{app_port}"
+    try:
+        await wait_ready(f"http://127.0.0.1:{llm_port}/stats", mock)
+        await wait_ready(f"{base_url}/bench/stats", app)
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        timeout = httpx.Timeout(options.timeout)
+        # httpx scans its whole pool on every request, so one client with thousands of connections
+        # costs the driver more CPU than the server; spread conversations over small pools instead
+        # (plain http to localhost, so skip loading CA certificates for each one)
+        pools = [
+            httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout, verify=False)
+            for _ in range(-(-options.conversations // CONVERSATIONS_PER_POOL))
+        ]
+        async with contextlib.AsyncExitStack() as stack:
+            for pool in pools:
+                await stack.enter_async_context(pool)
+            client = pools[0]
+            # One throwaway turn so first-request costs (imports, connection setup) stay out of the numbers
+            await run_turn(client, [{"role": "user", "content": "warm-up"}], {}, Results())
+            llm_before = (await client.get(f"http://127.0.0.1:{llm_port}/stats")).json()
+            await client.post("/bench/reset")
+            results = Results()
+            started = time.perf_counter()
+            driver_cpu = time.process_time()
+
+            async def start(index):
+                if options.ramp_s:
+                    await asyncio.sleep(options.ramp_s * index / options.conversations)
+                await conversation(pools[index % len(pools)], index, options, results)
+
+            await asyncio.gather(*(start(i) for i in range(options.conversations)))
+            wall = time.perf_counter() - started
+            driver_cpu = time.process_time() - driver_cpu
+            server_stats = (await client.get("/bench/stats")).json()
+            llm_stats = (await client.get(f"http://127.0.0.1:{llm_port}/stats")).json()
+    finally:
+        for proc in (app, mock):
+            proc.terminate()
+        for proc in (app, mock):
+            proc.wait(timeout=10)
+
+    streams = max(results.turns, 1)
+    return {
+        "label": label,
+        "conversations": options.conversations,
+        "turns": results.turns,
+        "errors": results.errors,
+        "rejected_429": results.rejected,
+        "wall_s": round(wall, 2),
+        "turns_per_s": round(results.turns / wall, 1),
+        "ttft_ms": {q: ms(percentile(results.ttft, v)) for q, v in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "latency_ms": {q: ms(percentile(results.latency, v)) for q, v in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "followup_latency_ms": {q: ms(percentile(results.followup_latency, v)) for q, v in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "queue_wait_ms": {q: ms(percentile(results.queue_wait, v)) for q, v in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "frames_per_s": round(results.frames / wall, 1),
+        "frames_per_turn": round(results.frames / streams, 1),
+        "server_cpu_ms_per_stream": round(server_stats["cpu_seconds"] * 1000 / streams, 2),
+        # If the driver used most of the wall time, it (not the server) is the bottleneck
+        "driver_cpu_s": round(driver_cpu, 2),
+        "connection_seconds": round(results.connection_seconds, 1),
+        "loop_lag_ms": server_stats["loop_lag"],
+        "llm_requests": {kind: llm_stats[f"{kind}_requests"] - llm_before[f"{kind}_requests"] for kind in ("stream", "completion")},
+        "firestore": server_stats["firestore"],
+    }
+
+
+def print_result(result):
+    print(f"\n== {result['label']} ==")
+    print(f"  turns             {result['turns']} ({result['conversations']} conversations, {result['errors']} errors, {result['rejected_429']} x 429) in {result['wall_s']}s")
+    print(f"  throughput        {result['turns_per_s']} turns/s, {result['frames_per_s']} frames/s ({result['frames_per_turn']} per turn)")
+    print(f"  ttft ms           p50 {result['ttft_ms']['p50']}  p95 {result['ttft_ms']['p95']}  p99 {result['ttft_ms']['p99']}")
+    print(f"  turn latency ms   p50 {result['latency_ms']['p50']}  p95 {result['latency_ms']['p95']}  p99 {result['latency_ms']['p99']}")
+    print(f"  follow-up turn ms p50 {result['followup_latency_ms']['p50']}  p95 {result['followup_latency_ms']['p95']}  p99 {result['followup_latency_ms']['p99']}")
+    print(f"  queue wait ms     p50 {result['queue_wait_ms']['p50']}  p95 {result['queue_wait_ms']['p95']}  p99 {result['queue_wait_ms']['p99']}")
+    print(f"  cpu               server {result['server_cpu_ms_per_stream']} ms per stream, driver {result['driver_cpu_s']}s total")
+    print(f"  sse connection-s  {result['connection_seconds']}")
+    lag = result["loop_lag_ms"]
+    print(f"  loop lag ms       p50 {lag.get('p50_ms')}  p99 {lag.get('p99_ms')}  max {lag.get('max_ms')}")
+    print(f"  llm requests      {result['llm_requests']['stream']} streamed, {result['llm_requests']['completion']} extraction")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load benchmark for the chat server")
+    parser.add_argument("--scenario", default="chat", choices=[*SCENARIOS, "all"])
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--ramp-s", type=float, default=0.0, help="spread conversation starts over this many seconds")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--complete-threads", action="store_true", help="send completed threads (canned rejection path)")
+    parser.add_argument("--ttft-ms", type=float, default=300.0)
+    parser.add_argument("--token-delay-ms", type=float, default=20.0)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--extraction-ms", type=float, default=400.0)
+    parser.add_argument("--complete-rate", type=float, default=0.3)
+    parser.add_argument("--new-topic-rate", type=float, default=0.05)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra server environment, repeatable")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    runs = [run for name in (SCENARIOS if args.scenario == "all" else [args.scenario]) for run in SCENARIOS[name]]
+
+    results = []
+    for label, overrides, env in runs:
+        options = argparse.Namespace(**{**vars(args), **overrides})
+        result = asyncio.run(run_once(label, options, {**env, **extra_env}))
+        print_result(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
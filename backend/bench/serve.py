@@ -0,0 +1,98 @@
+# bench/serve.py
+# Runs server.app against the in-memory Firestore fake, with an event-loop lag probe and
+# /bench/stats + /bench/reset endpoints the benchmark driver reads. Point the LLM calls at the mock
+# with LLM_BASE_URL (run.py does this for you).
+#
+#   LLM_BASE_URL=http://127.0.0.1:8900/v1 QWEN_30B=bench python bench/serve.py --port 8901
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import time
+from collections import deque
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+# server.py mounts ../frontend/out relative to the backend directory
+os.chdir(BACKEND_DIR)
+
+import fake_firestore  # noqa: E402
+
+fake_db = fake_firestore.install()
+
+import uvicorn  # noqa: E402
+
+import server  # noqa: E402
+
+LOOP_PROBE_INTERVAL = 0.01
+
+
+class LoopLagProbe:
+    """Sleeps LOOP_PROBE_INTERVAL at a time and records how late it wakes up."""
+
+    def __init__(self, keep=100_000):
+        self.samples = deque(maxlen=keep)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(LOOP_PROBE_INTERVAL)
+            self.samples.append(loop.time() - start - LOOP_PROBE_INTERVAL)
+
+    def summary(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {"samples": 0}
+        pick = lambda q: round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 2)
+        return {"samples": len(samples), "p50_ms": pick(0.5), "p99_ms": pick(0.99), "max_ms": round(samples[-1] * 1000, 2)}
+
+
+probe = LoopLagProbe()
+_since = {"wall": time.monotonic(), "cpu": 0.0}
+
+
+def _cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def bench_stats():
+    return {
+        "loop_lag": probe.summary(),
+        "cpu_seconds": round(_cpu_seconds() - _since["cpu"], 3),
+        "wall_seconds": round(time.monotonic() - _since["wall"], 3),
+        "firestore": fake_db.stats(),
+        "tasks": server.task_registry.metrics(),
+    }
+
+
+async def bench_reset():
+    probe.samples.clear()
+    _since["wall"] = time.monotonic()
+    _since["cpu"] = _cpu_seconds()
+    return {"ok": True}
+
+
+# Ahead of the static frontend mount at "/", which would otherwise swallow these paths
+for path, endpoint, methods in (("/bench/stats", bench_stats, ["GET"]), ("/bench/reset", bench_reset, ["POST"])):
+    server.app.add_api_route(path, endpoint, methods=methods)
+    server.app.router.routes.insert(0, server.app.router.routes.pop())
+
+
+async def main(host, port):
+    config = uvicorn.Config(server.app, host=host, port=port, log_level="warning", backlog=4096, timeout_keep_alive=30)
+    probe_task = asyncio.create_task(probe.run())
+    try:
+        await uvicorn.Server(config).serve()
+    finally:
+        probe_task.cancel()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the chat server against fake Firestore for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8901)
+    args = parser.parse_args()
+    asyncio.run(main(args.host, args.port))
@@ -0,0 +1,319 @@
+# broker.py
+# Where a task's streamed chunks travel between the flow (publisher) and the SSE endpoint (subscriber).
+# Channels look like an asyncio.Queue to the nodes: put(chunk) to stream, put(None) to end the stream.
+# end(error) ends it from outside the flow (failed or expired), readers then see the error next to the metadata.
+# Readers get a cursor into the channel's event log, so a dropped SSE client can resume from its Last-Event-ID.
+import asyncio
+import json
+import os
+import re
+import time
+from collections import deque
+
+# "memory" keeps chunks in this worker, "redis" lets the POST and the SSE GET land on different workers/replicas
+STREAM_BROKER = os.environ.get("STREAM_BROKER", "memory")
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+# How long a task's Redis stream survives without new chunks
+REDIS_STREAM_TTL = int(os.environ.get("REDIS_STREAM_TTL", "300"))
+# How long one XREAD waits before looping (keeps reads cancellable)
+REDIS_BLOCK_MS = int(os.environ.get("REDIS_BLOCK_MS", "5000"))
+# Already-delivered events kept per in-memory task for Last-Event-ID replay
+STREAM_REPLAY_SIZE = int(os.environ.get("STREAM_REPLAY_SIZE", "1024"))
+
+
+class MemoryChannel:
+    """
+    Ring buffer of (event_id, chunk) with ids counting up from 1. At most `queue_size` events can be
+    waiting unread before put() blocks (backpressure), and the last `replay_size` events stay available
+    to readers reconnecting with a Last-Event-ID.
+    """
+
+    def __init__(self, task_id, metadata, queue_size, replay_size=STREAM_REPLAY_SIZE):
+        self.task_id = task_id
+        self.metadata = metadata
+        self.last_active = time.monotonic()
+        self.queue_size = queue_size
+        # Never smaller than the unread window, so unread events are never evicted
+        self._events = deque(maxlen=max(replay_size, queue_size))
+        self._next_id = 1
+        # Furthest any reader has got, what backpressure is measured against
+        self._delivered = 0
+        self._waiters = []
+        self.ended = False
+        self.error = None
+
+    def _notify(self):
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters = []
+
+    async def _wait(self):
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        await waiter
+
+    async def open(self):
+        pass
+
+    async def put(self, chunk):
+        while self.qsize() >= self.queue_size:
+            await self._wait()
+        self._append(chunk)
+
+    def _append(self, chunk):
+        self._events.append((self._next_id, chunk))
+        self._next_id += 1
+        self.last_active = time.monotonic()
+        if chunk is None:
+            self.ended = True
+        self._notify()
+
+    async def end(self, error=None):
+        # Skips backpressure, the reader may be gone. One that is lagging skips what this evicts.
+        if self.ended:
+            return
+        self.error = error
+        self._append(None)
+
+    def reader(self, after_id=None):
+        # Start after `after_id` (a Last-Event-ID), or from the beginning. None if it's no longer buffered.
+        first_id = self._events[0][0] if self._events else self._next_id
+        if after_id is None:
+            after_id = first_id - 1
+        else:
+            try:
+                after_id = int(after_id)
+            except ValueError:
+                return None
+            if not first_id - 1 <= after_id < self._next_id:
+                return None
+        return MemoryReader(self, after_id)
+
+    def _event_after(self, cursor):
+        if cursor >= self._next_id - 1:
+            return None
+        first_id = self._events[0][0]
+        # A reader lagging behind the replay window skips what was evicted
+        event = self._events[max(cursor + 1 - first_id, 0)]
+        if event[0] > self._delivered:
+            self._delivered = event[0]
+            self._notify()
+        self.last_active = time.monotonic()
+        return event
+
+    def qsize(self):
+        return self._next_id - 1 - self._delivered
+
+    async def close(self):
+        pass
+
+
+class MemoryReader:
+    def __init__(self, channel, after_id):
+        self.channel = channel
+        self.last_id = after_id
+
+    @property
+    def metadata(self):
+        return self.channel.metadata
+
+    @property
+    def error(self):
+        return self.channel.error
+
+    def get_nowait(self):
+        event = self.channel._event_after(self.last_id)
+        if event is None:
+            if self.channel.ended:
+                # Already at the end marker, e.g. resumed from the metadata frame's id
+                return None
+            raise asyncio.QueueEmpty
+        self.last_id = event[0]
+        return event[1]
+
+    async def get(self, timeout=None):
+        # With a timeout, raises asyncio.TimeoutError if nothing arrived in time
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            try:
+                return self.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+            if deadline is None:
+                await self.channel._wait()
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError
+            try:
+                await asyncio.wait_for(self.channel._wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+
+class InMemoryBroker:
+    # Chunks never leave this process, so the POST and the SSE GET must hit the same worker
+    is_local = True
+
+    def channel(self, task_id, metadata, queue_size):
+        return MemoryChannel(task_id, metadata, queue_size)
+
+    async def attach(self, task_id):
+        # Only tasks in this worker's own registry exist
+        return None
+
+    async def close(self):
+        pass
+
+
+REDIS_ENTRY_ID = re.compile(r"\d+(-\d+)?")
+
+
+def _text(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+class RedisChannel:
+    """
+    One Redis Stream per task. Chunks are XADDed by whichever worker runs the flow and XREAD by
+    whichever worker serves the SSE GET. The end of the stream carries the final thread metadata,
+    since the subscriber may not share memory with the flow.
+    The stream keeps every entry until it expires, so any Redis entry id can be resumed from.
+    """
+
+    def __init__(self, client, task_id, metadata, ttl=REDIS_STREAM_TTL, block_ms=REDIS_BLOCK_MS):
+        self.task_id = task_id
+        self.metadata = metadata
+        self.key = f"chat:stream:{task_id}"
+        self.last_active = time.monotonic()
+        self.ended = False
+        self._client = client
+        self._ttl = ttl
+        self._block_ms = block_ms
+
+    async def _add(self, fields):
+        async with self._client.pipeline(transaction=False) as pipe:
+            pipe.xadd(self.key, fields)
+            pipe.expire(self.key, self._ttl)
+            await pipe.execute()
+        self.last_active = time.monotonic()
+
+    async def open(self):
+        # Marks the task as existing before the first chunk, so other workers can attach to it
+        await self._add({"type": "start"})
+
+    async def put(self, chunk):
+        if chunk is None:
+            await self.end()
+        else:
+            await self._add({"type": "chunk", "content": chunk})
+
+    async def end(self, error=None):
+        if self.ended:
+            return
+        self.ended = True
+        fields = {"type": "end", "metadata": json.dumps(self.metadata)}
+        if error:
+            fields["error"] = error
+        await self._add(fields)
+
+    def reader(self, after_id=None):
+        # XREAD would fail mid-stream on a malformed id, so refuse it up front like the in-memory channel does
+        if after_id is not None and not REDIS_ENTRY_ID.fullmatch(after_id):
+            return None
+        return RedisReader(self, after_id or "0-0")
+
+    def qsize(self):
+        # Backlog lives in Redis, not in this process
+        return 0
+
+    async def close(self):
+        await self._client.delete(self.key)
+
+
+class RedisReader:
+    def __init__(self, channel, after_id):
+        self.channel = channel
+        self.last_id = after_id
+        self.metadata = channel.metadata
+        self.error = None
+        self._pending = deque()
+        # A resumed reader may already be at the end entry, which XREAD would never return again
+        self._check_end = after_id != "0-0"
+
+    def get_nowait(self):
+        # Only serves entries already fetched by a previous XREAD
+        while self._pending:
+            entry_id, fields = self._pending.popleft()
+            self.last_id = _text(entry_id)
+            fields = {_text(k): _text(v) for k, v in fields.items()}
+            self.channel.last_active = time.monotonic()
+            if fields.get("type") == "chunk":
+                return fields.get("content", "")
+            if fields.get("type") == "end":
+                self.metadata = json.loads(fields.get("metadata") or "{}")
+                self.error = fields.get("error")
+                return None
+        raise asyncio.QueueEmpty
+
+    async def get(self, timeout=None):
+        # The timeout becomes the XREAD block time: cancelling a blocked XREAD instead would make
+        # redis-py drop the connection, i.e. reconnect once per coalesced frame
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            try:
+                return self.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+            channel = self.channel
+            if self._check_end:
+                self._check_end = False
+                last = await channel._client.xrevrange(channel.key, count=1)
+                if last and _text(last[0][0]) == self.last_id and {_text(k): _text(v) for k, v in last[0][1].items()}.get("type") == "end":
+                    self._pending.extend(last)
+                    continue
+            block_ms = channel._block_ms
+            if deadline is not None:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                # block=0 would mean forever
+                block_ms = max(min(int(remaining * 1000), block_ms), 1)
+            response = await channel._client.xread({channel.key: self.last_id}, count=100, block=block_ms)
+            for _stream, entries in response or []:
+                self._pending.extend(entries)
+
+
+class RedisStreamBroker:
+    is_local = False
+
+    def __init__(self, url=REDIS_URL, client=None, ttl=REDIS_STREAM_TTL):
+        if client is None:
+            # Optional dependency, only needed when STREAM_BROKER=redis
+            import redis.asyncio as redis
+            client = redis.from_url(url, decode_responses=True)
+        self._client = client
+        self._ttl = ttl
+
+    def channel(self, task_id, metadata, queue_size):
+        return RedisChannel(self._client, task_id, metadata, self._ttl)
+
+    async def attach(self, task_id):
+        channel = RedisChannel(self._client, task_id, {}, self._ttl)
+        if not await self._client.exists(channel.key):
+            return None
+        return channel
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def create_broker(kind=STREAM_BROKER):
+    if kind == "redis":
+        return RedisStreamBroker()
+    if kind == "memory":
+        return InMemoryBroker()
+    raise ValueError(f"Unknown STREAM_BROKER {kind!r}, expected 'memory' or 'redis'")
@@ -0,0 +1,36 @@
+# canned_responses.py
+# Fixed replies that don't need an LLM. Their SSE frames are encoded once at import, so serving one
+# is a single write instead of a flow coroutine trickling words into a queue.
+import json
+
+REJECT = "reject"
+
+CANNED_RESPONSES = {
+    REJECT: "This complaint thread has ended. Create a new chat if you want to start anther complaint!",
+}
+
+# Sent as an SSE error frame when a stream ends without an answer
+FLOW_FAILED = "Sorry, something went wrong while answering. Please try again."
+TASK_EXPIRED = "This chat took too long to answer. Please try again."
+
+DONE_FRAME = f"data: {json.dumps({'done': True})}\n\n"
+
+
+def sse_frame(payload, event_id=None):
+    # The id lets a reconnecting client resume with Last-Event-ID
+    if event_id is not None:
+        return f"id: {event_id}\ndata: {json.dumps(payload)}\n\n"
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def metadata_frame(metadata, event_id=None):
+    return sse_frame({"type": "metadata", "threadMetaData": metadata}, event_id)
+
+
+# Pre-encoded content frame per canned response
+CANNED_FRAMES = {key: sse_frame({"content": text}) for key, text in CANNED_RESPONSES.items()}
+
+
+def encode_canned(key, metadata):
+    # Whole SSE body: content, metadata (the only per-task part) and the done sentinel
+    return CANNED_FRAMES[key] + metadata_frame(metadata) + DONE_FRAME
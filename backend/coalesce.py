@@ -0,0 +1,96 @@
+# coalesce.py
+# LLM deltas are often a single character. Sending one queue item / SSE frame per delta makes
+# per-chunk overhead dominate, so chunks are merged within a small time window or up to a size.
+import asyncio
+import os
+
+STREAM_COALESCE_MS = float(os.environ.get("STREAM_COALESCE_MS", "20"))
+STREAM_COALESCE_MAX_CHARS = int(os.environ.get("STREAM_COALESCE_MAX_CHARS", "256"))
+
+
+class ChunkCoalescer:
+    """
+    Wraps a task channel (anything with `async put`) and forwards chunks in batches.
+    A batch is flushed once it reaches `max_chars`, or `window_ms` after its first chunk.
+    put(None) flushes what is left and then forwards the end-of-stream None.
+    """
+
+    def __init__(self, channel, window_ms=STREAM_COALESCE_MS, max_chars=STREAM_COALESCE_MAX_CHARS):
+        self.channel = channel
+        self.window = window_ms / 1000
+        self.max_chars = max_chars
+        self.flushes = 0
+        self._parts = []
+        self._size = 0
+        self._timer = None
+        # The flush the timer started, put(None) waits for it so the end marker can't overtake its batch
+        self._timer_flush = None
+        # Keeps batches in order when a timer flush and an inline flush overlap
+        self._lock = asyncio.Lock()
+
+    async def put(self, chunk):
+        if chunk is None:
+            await self.flush()
+            if self._timer_flush is not None:
+                await self._timer_flush
+            async with self._lock:
+                await self.channel.put(None)
+            return
+        self._parts.append(chunk)
+        self._size += len(chunk)
+        if self._size >= self.max_chars or self.window <= 0:
+            await self.flush()
+        elif self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.window, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._timer_flush = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._parts:
+            return
+        batch = "".join(self._parts)
+        self._parts = []
+        self._size = 0
+        async with self._lock:
+            await self.channel.put(batch)
+        self.flushes += 1
+
+
+async def read_batch(reader, window_ms=STREAM_COALESCE_MS, max_chars=STREAM_COALESCE_MAX_CHARS):
+    """
+    Wait for the next chunk, then drain whatever else arrives within `window_ms` (up to `max_chars`).
+    Returns (text, ended, last_id) where ended means the end-of-stream None was reached and
+    last_id is the event id of the last chunk in `text`.
+    """
+    chunk = await reader.get()
+    if chunk is None:
+        return "", True, None
+    parts = [chunk]
+    size = len(chunk)
+    last_id = reader.last_id
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + window_ms / 1000
+    while size < max_chars:
+        try:
+            chunk = reader.get_nowait()
+        except asyncio.QueueEmpty:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                # Not wait_for: the reader bounds its own wait (a cancelled Redis XREAD costs a reconnect)
+                chunk = await reader.get(timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+        if chunk is None:
+            return "".join(parts), True, last_id
+        parts.append(chunk)
+        size += len(chunk)
+        last_id = reader.last_id
+    return "".join(parts), False, last_id
@@ -0,0 +1,68 @@
+# dedupe_topics.py
+# Offline clean-up of the 'topics' collection: clusters near-duplicate topic names (see topic_matcher.py)
+# and merges each cluster into one canonical topic, re-pointing the threads filed under the duplicates.
+# Dry run by default, pass --apply to write.
+#
+#   python dedupe_topics.py                  # print the clusters that would be merged
+#   python dedupe_topics.py --apply --threshold 0.85
+import argparse
+import asyncio
+from collections import Counter
+
+import persistence
+from topic_matcher import TOPIC_MATCH_THRESHOLD, TopicMatcher, topic_key
+
+
+def pick_canonical(names):
+    # The wording most topics in the cluster normalize to, then its most common spelling, then the shortest
+    key_counts = Counter(topic_key(name) for name in names)
+    name_counts = Counter(names)
+    return min(names, key=lambda name: (-key_counts[topic_key(name)], -name_counts[name], len(name), name))
+
+
+def plan_merges(docs, threshold=TOPIC_MATCH_THRESHOLD):
+    """docs: [(doc_id, data)] -> [(canonical_name, [(duplicate_id, duplicate_name)])]"""
+    docs = [(doc_id, data) for doc_id, data in docs if data.get("topic")]
+    matcher = TopicMatcher([data["topic"] for _, data in docs], threshold)
+    merges = []
+    for cluster in matcher.clusters():
+        if len(cluster) < 2:
+            continue
+        names = [docs[position][1]["topic"] for position in cluster]
+        canonical = pick_canonical(names)
+        keep = next(position for position in cluster if docs[position][1]["topic"] == canonical)
+        duplicates = [(docs[position][0], docs[position][1]["topic"]) for position in cluster if position != keep]
+        merges.append((canonical, duplicates))
+    return merges
+
+
+async def main(apply, threshold, topics_collection, threads_collection):
+    docs = await persistence.list_documents(topics_collection)
+    merges = plan_merges(docs, threshold)
+    duplicates = sum(len(group) for _, group in merges)
+    print(f"{len(docs)} topics, {len(merges)} clusters of near-duplicates, {duplicates} topics to merge")
+    for canonical, group in merges:
+        print(f"  {canonical!r} <- {', '.join(repr(name) for _, name in group)}")
+
+    if not apply:
+        print("Dry run, pass --apply to merge")
+        return
+
+    moved = 0
+    for canonical, group in merges:
+        for duplicate_id, duplicate_name in group:
+            moved += await persistence.merge_topic(duplicate_id, duplicate_name, canonical, topics_collection, threads_collection)
+    print(f"Merged {duplicates} topics ({len(docs) - duplicates} left), re-pointed {moved} threads")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge near-duplicate topics in Firestore")
+    parser.add_argument("--apply", action="store_true", help="write the merges (default is a dry run)")
+    parser.add_argument("--threshold", type=float, default=TOPIC_MATCH_THRESHOLD, help="trigram similarity (0-1) to merge at")
+    parser.add_argument("--topics-collection", default="topics")
+    parser.add_argument("--threads-collection", default="threads")
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args.apply, args.threshold, args.topics_collection, args.threads_collection))
+    finally:
+        persistence.shutdown()
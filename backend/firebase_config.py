@@ -1,8 +1,30 @@
 import os
-import firebase_admin
-from firebase_admin import credentials, firestore
+import threading
 
-cred = credentials.Certificate('complainsg_firestorekey.json')
-firebase_admin.initialize_app(cred)
+# Firestore is initialized on first use (normally from the FastAPI lifespan), not at import,
+# so importing the app is fast and doesn't need the key file
+FIREBASE_KEY_PATH = os.environ.get("FIREBASE_KEY_PATH", "complainsg_firestorekey.json")
 
-db = firestore.client()
\ No newline at end of file
+_db = None
+_lock = threading.Lock()
+
+
+def get_db():
+    global _db
+    if _db is None:
+        with _lock:
+            if _db is None:
+                import firebase_admin
+                from firebase_admin import credentials, firestore
+
+                cred = credentials.Certificate(FIREBASE_KEY_PATH)
+                firebase_admin.initialize_app(cred)
+                _db = firestore.client()
+    return _db
+
+
+def __getattr__(name):
+    # firebase_config.db keeps working, it just initializes on first access
+    if name == "db":
+        return get_db()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
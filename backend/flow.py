@@ -1,20 +1,59 @@
+import os
+
 from pocketflow import AsyncFlow
 
+from metrics import instrument_node as timed_node
+
 from nodes import (
+    HTTPRouterNodeAsync,
     HTTPGenerateNodeAsync,
     HTTPDataExtractionNodeAsync,
     HTTPSummarizerNodeAsync,
     HTTPRejectionNodeAsync,
+    HTTPSpeculativeExtractionNodeAsync,
+    HTTPSpeculativeCommitNodeAsync,
 )
+
+# Start streaming the clarifying question while extraction is still running (costs a wasted
+# generation call on turns that end up summarized/rejected)
+SPECULATIVE_FLOW = os.environ.get("SPECULATIVE_FLOW", "0") == "1"
     
-def generate_or_summarize_flow():
-    generate = HTTPGenerateNodeAsync()
-    extraction = HTTPDataExtractionNodeAsync()
-    summarizer = HTTPSummarizerNodeAsync()
-    rejection = HTTPRejectionNodeAsync()
+def generate_or_summarize_flow(speculative=SPECULATIVE_FLOW):
+    if speculative:
+        return speculative_generate_or_summarize_flow()
+
+    # Every node's prep/exec/post is timed into /metrics (and the task trace if enabled)
+    router = timed_node(HTTPRouterNodeAsync())
+    generate = timed_node(HTTPGenerateNodeAsync())
+    extraction = timed_node(HTTPDataExtractionNodeAsync())
+    summarizer = timed_node(HTTPSummarizerNodeAsync())
+    rejection = timed_node(HTTPRejectionNodeAsync())
+
+    # Completed threads are rejected before any Firestore / LLM work
+    router - 'reject' >> rejection
+    router - 'extract' >> extraction
 
     extraction - 'continue' >> generate
     extraction - 'summarize' >> summarizer
     extraction - 'reject' >> rejection
 
-    return AsyncFlow(start=extraction)
\ No newline at end of file
+    return AsyncFlow(start=router)
+
+def speculative_generate_or_summarize_flow():
+    router = timed_node(HTTPRouterNodeAsync())
+    extraction = timed_node(HTTPSpeculativeExtractionNodeAsync())
+    # The extraction / generation it runs side by side are timed on their own too
+    timed_node(extraction.extraction)
+    timed_node(extraction.generate)
+    commit = timed_node(HTTPSpeculativeCommitNodeAsync())
+    summarizer = timed_node(HTTPSummarizerNodeAsync())
+    rejection = timed_node(HTTPRejectionNodeAsync())
+
+    router - 'reject' >> rejection
+    router - 'extract' >> extraction
+
+    extraction - 'continue' >> commit
+    extraction - 'summarize' >> summarizer
+    extraction - 'reject' >> rejection
+
+    return AsyncFlow(start=router)
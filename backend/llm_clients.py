@@ -0,0 +1,94 @@
+# llm_clients.py
+import asyncio
+import importlib.util
+import os
+
+# openai / anthropic / httpx are imported on first use, they are most of the app's import time
+
+# Process-wide LLM clients, one per (base_url, api_key), so every turn reuses the same
+# keep-alive connection pool instead of paying DNS + TLS on each call
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.environ.get("LLM_KEEPALIVE_EXPIRY", "60"))
+# SDK-level retries per call; with several providers in LLM_PROVIDERS, lower this so llm_router fails over sooner
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+# HTTP/2 needs the optional h2 package (httpx[http2])
+LLM_HTTP2 = os.environ.get("LLM_HTTP2", "1") == "1" and importlib.util.find_spec("h2") is not None
+# Connections opened per provider at startup, so the first turns don't pay DNS + TLS (0 disables)
+LLM_PREWARM_CONNECTIONS = int(os.environ.get("LLM_PREWARM_CONNECTIONS", "2"))
+LLM_PREWARM_TIMEOUT = float(os.environ.get("LLM_PREWARM_TIMEOUT", "5"))
+
+_async_openai_clients = {}
+_http_clients = {}
+_anthropic_clients = {}
+
+
+def _limits():
+    import httpx
+
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_async_openai(base_url, api_key):
+    key = (base_url, api_key)
+    client = _async_openai_clients.get(key)
+    if client is None:
+        import httpx
+        from openai import AsyncOpenAI
+
+        http_client = httpx.AsyncClient(http2=LLM_HTTP2, limits=_limits())
+        client = AsyncOpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            max_retries=LLM_MAX_RETRIES,
+            http_client=http_client,
+        )
+        _async_openai_clients[key] = client
+        _http_clients[key] = http_client
+    return client
+
+
+def get_anthropic(api_key):
+    client = _anthropic_clients.get(api_key)
+    if client is None:
+        import anthropic
+        import httpx
+
+        client = anthropic.Anthropic(
+            api_key=api_key,
+            http_client=httpx.Client(http2=LLM_HTTP2, limits=_limits()),
+        )
+        _anthropic_clients[api_key] = client
+    return client
+
+
+async def prewarm(endpoints, connections=LLM_PREWARM_CONNECTIONS):
+    """
+    Create the clients for (base_url, api_key) pairs and open `connections` keep-alive connections
+    to each, by sending HEAD requests in parallel (the response status doesn't matter).
+    Best effort: an unreachable provider is left cold.
+    """
+    async def warm(base_url, api_key):
+        get_async_openai(base_url, api_key)
+        http_client = _http_clients[(base_url, api_key)]
+        requests = [http_client.head(base_url, timeout=LLM_PREWARM_TIMEOUT) for _ in range(connections)]
+        return await asyncio.gather(*requests, return_exceptions=True)
+
+    if connections <= 0:
+        return []
+    results = await asyncio.gather(*(warm(base_url, api_key) for base_url, api_key in endpoints), return_exceptions=True)
+    return [not isinstance(result, Exception) and not any(isinstance(r, Exception) for r in result) for result in results]
+
+
+async def close_clients():
+    for client in _async_openai_clients.values():
+        await client.close()
+    for client in _anthropic_clients.values():
+        client.close()
+    _async_openai_clients.clear()
+    _http_clients.clear()
+    _anthropic_clients.clear()
@@ -0,0 +1,371 @@
+# llm_router.py
+# Routes the async LLM calls over one or more OpenAI-compatible providers (OpenRouter, another
+# gateway, a local mock...). Each provider has its own concurrency limit and circuit breaker, and
+# every request (hedges included) also takes a slot from the global, priority-ordered admission.py limit.
+# A call goes to the first healthy provider; if it hasn't produced its first token (or, for
+# non-streamed calls, its response) within the hedge deadline, the next provider is fired too
+# and whichever answers first wins, the other is cancelled. Errors before the first token fail over.
+#
+# LLM_PROVIDERS is a JSON list, e.g.
+#   [{"name": "openrouter", "base_url": "https://openrouter.ai/api/v1", "api_key_env": "QWEN_30B"},
+#    {"name": "backup", "base_url": "http://10.0.0.5:8000/v1", "api_key_env": "BACKUP_KEY",
+#     "max_concurrency": 16, "models": {"qwen/qwen3-30b-a3b:free": "qwen3-30b"}}]
+# Without it there is a single provider at LLM_BASE_URL using the QWEN_30B key.
+import asyncio
+import json
+import os
+import time
+
+from admission import admission
+from llm_clients import get_async_openai, prewarm
+from log import get_logger, fields
+from metrics import LLM_HEDGES, LLM_PROVIDER_REQUESTS
+
+logger = get_logger("llm_router")
+
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL", "https://openrouter.ai/api/v1")
+LLM_PROVIDERS = os.environ.get("LLM_PROVIDERS", "")
+# Default in-flight request limit per provider
+LLM_PROVIDER_MAX_CONCURRENCY = int(os.environ.get("LLM_PROVIDER_MAX_CONCURRENCY", "64"))
+# Fire the next provider if the first streamed token hasn't arrived after this long
+LLM_HEDGE_TTFT_MS = float(os.environ.get("LLM_HEDGE_TTFT_MS", "2500"))
+# Same for non-streamed calls (extraction), measured to the full response
+LLM_HEDGE_CALL_MS = float(os.environ.get("LLM_HEDGE_CALL_MS", "10000"))
+# Consecutive failures that open a provider's breaker, and how long it stays open
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_S = float(os.environ.get("LLM_BREAKER_RESET_S", "30"))
+
+
+class LLMUnavailable(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go through. Opens after `failure_threshold` consecutive failures and rejects calls
+    for `reset_after` seconds, then lets a single trial call through (half-open): success closes it,
+    failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=LLM_BREAKER_FAILURES, reset_after=LLM_BREAKER_RESET_S):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_after:
+            return "half_open"
+        return "open"
+
+    def available(self):
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self._trial_in_flight)
+
+    def allow(self):
+        # Like available(), but claims the half-open trial
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_in_flight or self.failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+    def release_trial(self):
+        # A trial call that was cancelled (lost a hedge) says nothing about the provider's health
+        self._trial_in_flight = False
+
+
+class Provider:
+    def __init__(self, name, base_url, api_key, max_concurrency=LLM_PROVIDER_MAX_CONCURRENCY, models=None, breaker=None):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        # Requested model -> this provider's name for it (unlisted models are passed through)
+        self.models = models or {}
+        self.breaker = breaker or CircuitBreaker()
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+
+    @property
+    def client(self):
+        return get_async_openai(self.base_url, self.api_key)
+
+    def model_for(self, model):
+        return self.models.get(model, model)
+
+    def has_capacity(self):
+        return self.in_flight < self.max_concurrency
+
+    async def acquire(self):
+        await self.semaphore.acquire()
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self.semaphore.release()
+
+    def status(self):
+        return {
+            "name": self.name,
+            "base_url": self.base_url,
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+        }
+
+
+class StreamHandle:
+    # A provider's stream that has produced its first content chunk (or ended), still holding its slots
+    def __init__(self, provider, stream, chunks, head, release):
+        self.provider = provider
+        self.stream = stream
+        self.chunks = chunks
+        self.head = head
+        self._release = release
+
+    async def discard(self):
+        try:
+            await self.stream.close()
+        finally:
+            self._release()
+
+
+def _has_content(chunk):
+    return bool(chunk.choices) and chunk.choices[0].delta.content
+
+
+class LLMRouter:
+    def __init__(self, providers, hedge_ttft_ms=LLM_HEDGE_TTFT_MS, hedge_call_ms=LLM_HEDGE_CALL_MS, scheduler=admission):
+        if not providers:
+            raise ValueError("LLMRouter needs at least one provider")
+        self.providers = providers
+        self.scheduler = scheduler
+        self.hedge_ttft = hedge_ttft_ms / 1000
+        self.hedge_call = hedge_call_ms / 1000
+
+    def _candidates(self):
+        # Healthy providers in configured order, ones with a free slot first
+        healthy = [provider for provider in self.providers if provider.breaker.available()]
+        return [p for p in healthy if p.has_capacity()] + [p for p in healthy if not p.has_capacity()]
+
+    async def _acquire(self, provider):
+        # Global slot first (priority-ordered), then the provider's own limit
+        await self.scheduler.acquire()
+        try:
+            await provider.acquire()
+        except BaseException:
+            self.scheduler.release()
+            raise
+
+    def _release(self, provider):
+        provider.release()
+        self.scheduler.release()
+
+    async def _open_stream(self, provider, model, messages, kwargs, admitted):
+        await self._acquire(provider)
+        admitted()
+        try:
+            stream = await provider.client.chat.completions.create(
+                model=provider.model_for(model), messages=messages, stream=True, **kwargs
+            )
+            chunks = stream.__aiter__()
+            head = []
+            # Read up to the first content chunk (usage-only / role chunks are kept and replayed)
+            async for chunk in chunks:
+                head.append(chunk)
+                if _has_content(chunk):
+                    break
+            return StreamHandle(provider, stream, chunks, head, lambda: self._release(provider))
+        except BaseException:
+            self._release(provider)
+            raise
+
+    async def _call(self, provider, model, messages, kwargs, admitted):
+        await self._acquire(provider)
+        admitted()
+        try:
+            return await provider.client.chat.completions.create(model=provider.model_for(model), messages=messages, **kwargs)
+        finally:
+            self._release(provider)
+
+    async def _race(self, start_attempt, hedge_after, on_late_result=None):
+        """
+        Start an attempt on the first candidate, fire the next one if nothing has come back within
+        `hedge_after` (or immediately when an attempt fails), return (provider, result) of the first
+        success and cancel the rest. start_attempt(provider, admitted) calls admitted() once it holds its
+        slots: the hedge deadline runs from there, time queued for the global limit isn't slowness.
+        """
+        candidates = self._candidates()
+        if not candidates:
+            raise LLMUnavailable("All LLM providers are unavailable (circuit open)")
+        pending = {}
+        errors = []
+        remaining = list(candidates)
+        hedged = False
+        # When the latest attempt got its slots (None while it is still queued), and the event signalling it
+        admitted_at = None
+        admitted_event = None
+
+        def launch():
+            nonlocal admitted_at, admitted_event
+            while remaining:
+                provider = remaining.pop(0)
+                # Claims the half-open trial, if that's the state it is in
+                if provider.breaker.allow():
+                    admitted_at = None
+                    admitted_event = event = asyncio.Event()
+
+                    def admitted():
+                        nonlocal admitted_at
+                        if admitted_event is event:
+                            admitted_at = time.monotonic()
+                        event.set()
+
+                    pending[asyncio.create_task(start_attempt(provider, admitted))] = provider
+                    return True
+            return False
+
+        launch()
+        try:
+            while True:
+                if not pending and not launch():
+                    raise LLMUnavailable(f"All LLM providers failed: {'; '.join(errors)}")
+                timeout = None
+                waiting_admission = None
+                if remaining and not hedged:
+                    if admitted_at is None:
+                        # No deadline until the attempt is out of the admission queue
+                        waiting_admission = asyncio.ensure_future(admitted_event.wait())
+                    else:
+                        timeout = max(admitted_at + hedge_after - time.monotonic(), 0)
+                waits = set(pending) if waiting_admission is None else {*pending, waiting_admission}
+                try:
+                    done, _ = await asyncio.wait(waits, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    if waiting_admission is not None:
+                        waiting_admission.cancel()
+                if waiting_admission in done:
+                    done.discard(waiting_admission)
+                    if not done:
+                        # Admitted, now start the hedge clock
+                        continue
+                if not done:
+                    # Deadline passed with no answer: hedge with the next provider, keep the first one running
+                    hedged = True
+                    slow = ", ".join(provider.name for provider in pending.values())
+                    if launch():
+                        LLM_HEDGES.inc(slow=slow)
+                        logger.info("🪁 LLM ROUTER: hedging slow provider", extra=fields(slow=slow, after_ms=round(hedge_after * 1000)))
+                    continue
+                winner = None
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is not None:
+                        provider.breaker.record_failure()
+                        LLM_PROVIDER_REQUESTS.inc(provider=provider.name, outcome="error")
+                        errors.append(f"{provider.name}: {task.exception()!r}")
+                        logger.warning("❌ LLM ROUTER: provider failed, failing over", extra=fields(provider=provider.name, error=repr(task.exception())))
+                    elif winner is None:
+                        winner = (provider, task.result())
+                    elif on_late_result is not None:
+                        # Two finished in the same tick, the extra one is a loser
+                        LLM_PROVIDER_REQUESTS.inc(provider=provider.name, outcome="cancelled")
+                        provider.breaker.release_trial()
+                        await on_late_result(task.result())
+                if winner is not None:
+                    LLM_PROVIDER_REQUESTS.inc(provider=winner[0].name, outcome="won")
+                    return winner
+        finally:
+            for task, provider in pending.items():
+                task.cancel()
+                provider.breaker.release_trial()
+                LLM_PROVIDER_REQUESTS.inc(provider=provider.name, outcome="cancelled")
+                task.add_done_callback(lambda t: _discard_late(t, on_late_result))
+
+    async def stream(self, messages, model, **kwargs):
+        """Yields the winning provider's raw chat.completion.chunk objects."""
+        provider, handle = await self._race(
+            lambda p, admitted: self._open_stream(p, model, messages, kwargs, admitted), self.hedge_ttft, on_late_result=StreamHandle.discard
+        )
+        recorded = False
+        try:
+            for chunk in handle.head:
+                yield chunk
+            async for chunk in handle.chunks:
+                yield chunk
+        except Exception:
+            # Too late to fail over without repeating text, but the breaker should know
+            recorded = True
+            provider.breaker.record_failure()
+            raise
+        else:
+            recorded = True
+            provider.breaker.record_success()
+        finally:
+            if not recorded:
+                # Closed early by the consumer (aclose, cancellation): no verdict, but free a half-open trial
+                provider.breaker.release_trial()
+            await handle.discard()
+
+    async def call(self, messages, model, **kwargs):
+        provider, response = await self._race(lambda p, admitted: self._call(p, model, messages, kwargs, admitted), self.hedge_call)
+        provider.breaker.record_success()
+        return response
+
+    def status(self):
+        return [provider.status() for provider in self.providers]
+
+    async def prewarm(self):
+        # Open keep-alive connections to every provider before the first turn needs them
+        warmed = await prewarm([(provider.base_url, provider.api_key) for provider in self.providers])
+        for provider, ok in zip(self.providers, warmed):
+            if not ok:
+                logger.warning("❌ LLM ROUTER: could not pre-warm provider", extra=fields(provider=provider.name))
+        return warmed
+
+
+def _discard_late(task, discard):
+    # A cancelled hedge attempt may have finished (or failed) before the cancel landed:
+    # give its slot back, and consume the error so it isn't reported as never retrieved
+    if task.cancelled() or task.exception() is not None:
+        return
+    if discard is not None:
+        asyncio.ensure_future(discard(task.result()))
+
+
+def providers_from_config(config=LLM_PROVIDERS):
+    if not config:
+        return [Provider("openrouter", LLM_BASE_URL, os.environ.get("QWEN_30B"))]
+    providers = []
+    for entry in json.loads(config):
+        api_key = entry.get("api_key") or os.environ.get(entry.get("api_key_env", ""), "")
+        providers.append(Provider(
+            entry["name"],
+            entry["base_url"],
+            api_key,
+            max_concurrency=int(entry.get("max_concurrency", LLM_PROVIDER_MAX_CONCURRENCY)),
+            models=entry.get("models"),
+        ))
+    return providers
+
+
+llm_router = LLMRouter(providers_from_config())
@@ -0,0 +1,83 @@
+# log.py
+# Structured logging for the backend. Records are handed to a QueueHandler on the calling thread
+# and written to stdout by a QueueListener thread, so slow terminals/log shippers never block the event loop.
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# "text" for humans, "json" for log shippers
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+# Fraction of per-chunk (streaming) events that get logged at all
+LOG_CHUNK_SAMPLE_RATE = float(os.environ.get("LOG_CHUNK_SAMPLE_RATE", "0.01"))
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        payload.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    global _listener
+    if _listener is not None:
+        return
+    log_queue = queue.SimpleQueue()
+    sink = logging.StreamHandler()
+    sink.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    _listener = QueueListener(log_queue, sink, respect_handler_level=True)
+    _listener.start()
+    root = logging.getLogger("complainsg")
+    root.setLevel(level)
+    root.addHandler(QueueHandler(log_queue))
+    root.propagate = False
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    global _listener
+    if _listener is not None:
+        # Flushes whatever is still queued
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name):
+    setup_logging()
+    return logging.getLogger(f"complainsg.{name}")
+
+
+def fields(**kwargs):
+    # Structured key/values for a record: logger.info("msg", extra=fields(task_id=...))
+    return {"fields": kwargs}
+
+
+def sampled(rate=LOG_CHUNK_SAMPLE_RATE):
+    # For hot per-chunk events: only log a sample of them
+    return rate > 0 and random.random() < rate
@@ -0,0 +1,187 @@
+# metrics.py
+# Minimal in-process Prometheus-style metrics (text exposition format on /metrics) plus optional
+# per-task traces, so we can see where a turn's latency goes: Firestore, extraction, TTFT or streaming.
+import contextvars
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Keep a span-by-span trace of each task's flow, served at /api/traces/{task_id}
+FLOW_TRACES = os.environ.get("FLOW_TRACES", "0") == "1"
+FLOW_TRACES_KEPT = int(os.environ.get("FLOW_TRACES_KEPT", "500"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+_metrics = []
+_gauge_callbacks = []
+
+
+def _label_str(labels):
+    if not labels:
+        return ""
+    inner = ",".join(f'{key}="{str(value)}"' for key, value in labels)
+    return "{" + inner + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_label_str(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        # labels -> [bucket counts..., sum, count]
+        self._values = {}
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self._values.get(key)
+        if series is None:
+            series = self._values[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in self._values.items():
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_label_str(key + (('le', bound),))} {count}")
+            lines.append(f"{self.name}_bucket{_label_str(key + (('le', '+Inf'),))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_label_str(key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_label_str(key)} {series[-1]}")
+        return lines
+
+
+def register_gauges(callback):
+    # callback() -> {metric_name: value}, read at scrape time
+    _gauge_callbacks.append(callback)
+
+
+def render_metrics():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for callback in _gauge_callbacks:
+        for name, value in callback().items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+NODE_DURATION = Histogram("flow_node_duration_seconds", "Time spent in each node phase (prep/exec/post)")
+FLOW_ACTIONS = Counter("flow_actions_total", "Routing actions returned by each node")
+LLM_DURATION = Histogram("llm_request_duration_seconds", "Wall time of LLM calls, streamed until the last token")
+LLM_TTFT = Histogram("llm_time_to_first_token_seconds", "Time until the first streamed token")
+LLM_PROMPT_TOKENS = Histogram("llm_prompt_tokens", "Prompt tokens per LLM call", TOKEN_BUCKETS)
+LLM_COMPLETION_TOKENS = Histogram("llm_completion_tokens", "Completion tokens per LLM call", TOKEN_BUCKETS)
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups by cache and result (hit/miss)")
+LLM_PROVIDER_REQUESTS = Counter("llm_provider_requests_total", "LLM attempts per provider by outcome (won/error/cancelled)")
+LLM_HEDGES = Counter("llm_hedges_total", "Hedged LLM requests, by the provider that was too slow")
+PROMPT_HISTORY_TOKENS = Histogram("prompt_history_tokens", "Conversation history tokens per prompt after windowing", TOKEN_BUCKETS)
+PROMPT_TOKENS_SAVED = Counter("prompt_history_tokens_saved_total", "History tokens saved by windowing vs embedding the raw message list")
+LLM_ADMISSION_WAIT = Histogram("llm_admission_wait_seconds", "Time an LLM request waited for a global concurrency slot, by turn priority")
+
+
+# ---- Per-task traces ----
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_traces = OrderedDict()
+
+
+def start_trace(task_id):
+    # Called before the flow task is created so the flow (and tasks it spawns) inherit it
+    if not FLOW_TRACES:
+        return None
+    trace = {"task_id": task_id, "started_at": time.time(), "spans": []}
+    _traces[task_id] = trace
+    while len(_traces) > FLOW_TRACES_KEPT:
+        _traces.popitem(last=False)
+    _current_trace.set(trace)
+    return trace
+
+
+def get_trace(task_id):
+    return _traces.get(task_id)
+
+
+def add_span(name, duration, **attributes):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace["spans"].append({"name": name, "duration_ms": round(duration * 1000, 2), **attributes})
+
+
+def annotate(**attributes):
+    # Attach attributes (cache hit, token counts...) to the current task's trace
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.setdefault("attributes", {}).update(attributes)
+
+
+@contextmanager
+def timed(histogram, span_name=None, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        histogram.observe(duration, **labels)
+        if span_name:
+            add_span(span_name, duration, **labels)
+
+
+# ---- Flow instrumentation ----
+
+_instrumented_classes = {}
+
+
+def instrument_node(node):
+    """
+    Swap the node's class for a subclass whose prep/exec/post are timed.
+    Done on the class (not the instance) because pocketflow copy.copy()s nodes as it runs them.
+    """
+    cls = type(node)
+    wrapped = _instrumented_classes.get(cls)
+    if wrapped is None:
+        name = cls.__name__
+
+        async def prep_async(self, shared):
+            with timed(NODE_DURATION, f"{name}.prep", node=name, phase="prep"):
+                return await cls.prep_async(self, shared)
+
+        async def exec_async(self, prep_res):
+            with timed(NODE_DURATION, f"{name}.exec", node=name, phase="exec"):
+                return await cls.exec_async(self, prep_res)
+
+        async def post_async(self, shared, prep_res, exec_res):
+            with timed(NODE_DURATION, f"{name}.post", node=name, phase="post"):
+                action = await cls.post_async(self, shared, prep_res, exec_res)
+            FLOW_ACTIONS.inc(node=name, action=action or "default")
+            add_span(f"{name}.action", 0, action=action or "default")
+            return action
+
+        wrapped = type(name, (cls,), {"prep_async": prep_async, "exec_async": exec_async, "post_async": post_async})
+        _instrumented_classes[cls] = wrapped
+    node.__class__ = wrapped
+    return node
@@ -1,12 +1,36 @@
 # nodes.py
 from pocketflow import AsyncNode
-from utils import call_llm_async, stream_llm_async
+from utils import call_llm_async, stream_llm_async, count_tokens, QWEN_30B
 import json
-from firebase_config import db
+import os
+from topic_catalog import topic_catalog
+from response_cache import extraction_cache
+from coalesce import ChunkCoalescer
+from canned_responses import CANNED_RESPONSES, REJECT
 import asyncio
+from log import get_logger, fields
+from metrics import CACHE_REQUESTS, annotate
+from routing import missing_fields as get_missing_fields, route_after_extraction, route_thread
+from prompt_window import build_history, extraction_delta, history_hash, report_savings
 
-# If the complaint quality is at or below this threshold, it will try to atttempt to ask more questions
-complaint_threshold = 4
+# Model used for the JSON extraction call (part of the response cache key)
+EXTRACTION_MODEL = QWEN_30B
+
+logger = get_logger("nodes")
+
+# Incremental extraction only sends the messages added since the last extraction plus a rolling summary,
+# instead of the whole conversation every turn. Set INCREMENTAL_EXTRACTION=0 to always send the full history.
+INCREMENTAL_EXTRACTION = os.environ.get("INCREMENTAL_EXTRACTION", "1") == "1"
+
+class HTTPRouterNodeAsync(AsyncNode):
+    # Decides from threadMetaData alone (no Firestore / LLM) whether this turn needs extraction at all
+    async def prep_async(self, shared):
+        return shared.get("task_metadata", {})
+    async def exec_async(self, metadata):
+        return route_thread(metadata)
+    async def post_async(self, shared, prep_res, exec_res):
+        logger.info("🧭 ROUTER NODE: routing to %s", exec_res, extra=fields(action=exec_res))
+        return exec_res
 
 class HTTPDataExtractionNodeAsync(AsyncNode):
     async def prep_async(self, shared):
@@ -18,8 +42,12 @@ class HTTPDataExtractionNodeAsync(AsyncNode):
             "complaint_summary": shared.get("task_metadata", {}).get("complaint_summary", ""),
             "complaint_location": shared.get("task_metadata", {}).get("complaint_location", ""),
             "complaint_quality": shared.get("task_metadata", {}).get("complaint_quality", 0),
+            # Incremental extraction state carried in threadMetaData
+            "conversation_summary": shared.get("task_metadata", {}).get("conversation_summary", ""),
+            "extracted_message_count": shared.get("task_metadata", {}).get("extracted_message_count", 0),
+            "extracted_prefix_hash": shared.get("task_metadata", {}).get("extracted_prefix_hash", ""),
         }
-        print(f"🔍 DATA EXTRACTION NODE: Current inputs = {inputs}")
+        logger.debug("🔍 DATA EXTRACTION NODE: Current inputs = %s", inputs)
         return inputs
     async def exec_async(self, inputs):
         has_been_summarized = False
@@ -30,38 +58,52 @@ class HTTPDataExtractionNodeAsync(AsyncNode):
         complaint_location = inputs.get("complaint_location", {})
         complaint_summary = inputs.get("complaint_summary", "")
         complaint_quality = inputs.get("complaint_quality", 0)
+        conversation_summary = inputs.get("conversation_summary", "")
+        conversation_history = inputs["conversation_history"]
+        extracted_message_count = inputs.get("extracted_message_count", 0) or 0
+        extracted_prefix_hash = inputs.get("extracted_prefix_hash", "")
         
-        print(f"🔍 DATA EXTRACTION NODE: complaint_quality (pre LLM) = {complaint_quality}")
+        logger.debug("🔍 DATA EXTRACTION NODE: complaint_quality (pre LLM) = %s", complaint_quality)
 
-        # Check if any required metadata is missing (and if the complaint quality is below 3)
-        missing_fields = []
-        for key, value in inputs.items():
-            if key in ['complaint_topic', 'complaint_location', 'complaint_summary', 'complaint_quality']:
-                if not value:
-                    missing_fields.append(key)
-                if key == 'complaint_quality' and value < complaint_threshold:
-                    missing_fields.append(key)
+        # Check if any required metadata is missing (and if the complaint quality is at or below the threshold)
+        missing_fields = get_missing_fields(inputs)
         
-        # If no missing fields, this has been summarized before
+        # If no missing fields, this has been summarized before (normally caught earlier by HTTPRouterNodeAsync)
         if not missing_fields:
             has_been_summarized = True
             
         if not inputs.get("complaint_topic", ""):
             to_generate_topic = True
         
-         # Retrieve all documents from the 'topics' collection
-        topics_ref = db.collection('topics')
-        topics_docs = topics_ref.stream()
-        topics = [doc.to_dict() for doc in topics_docs]
-        
         if missing_fields:
-            # Extract topics from the retrieved documents
-            topic_list = [doc['topic'] for doc in topics]
+            # Topics come from the in-process catalog, not a Firestore scan per turn
+            topic_list = await topic_catalog.topic_names()
             topics_string = ', '.join(topic_list)
 
+            # Only the delta is needed if a previous turn already extracted from the earlier messages.
+            # An edited, regenerated or branched thread falls back to the full history (see extraction_delta).
+            new_messages = extraction_delta(conversation_history, extracted_message_count, extracted_prefix_hash)
+            incremental = INCREMENTAL_EXTRACTION and conversation_summary and new_messages is not None
+            if incremental:
+                history = build_history(new_messages, baseline=conversation_history)
+                conversation_block = f"""
+            Summary of the conversation so far: {conversation_summary}
+            
+            Already extracted: complaint_topic={complaint_topic or 'null'}, complaint_location={complaint_location or 'null'}, complaint_summary={complaint_summary or 'null'}, complaint_quality={complaint_quality or 'null'}
+            
+            New messages since the last extraction:
+            {history.text}
+            """
+            else:
+                # No usable rolling summary here (first extraction, edited/branched thread or incremental mode off)
+                history = build_history(conversation_history)
+                conversation_block = f"""Conversation history:
+            {history.text}
+            """
+
             # Include topics_string in the prompt
             prompt = f"""
-            Conversation history: {inputs['conversation_history']}
+            {conversation_block}
             
             The data I need: {', '.join(missing_fields)}
             
@@ -94,79 +136,97 @@ class HTTPDataExtractionNodeAsync(AsyncNode):
                 "complaint_topic": "extracted topic or null",
                 "complaint_location": "extracted location or null", 
                 "complaint_summary": "extracted summary or null",
-                "complaint_quality": "extracted quality or null"
+                "complaint_quality": "extracted quality or null",
+                "conversation_summary": "a compact summary of the whole conversation so far, including what has already been asked and answered"
             }}
             
             If you cannot extract a field, set it to null.
             """
             
-            response = await call_llm_async(prompt)
+            report_savings("extraction", history, incremental=bool(incremental), prompt_tokens=count_tokens(prompt))
+            
+            # Identical / replayed turns are answered from the cache without calling the LLM
+            cache_key = extraction_cache.make_key(EXTRACTION_MODEL, prompt, missing_fields, topic_catalog.version)
+            response = await extraction_cache.aget(cache_key)
+            from_cache = response is not None
+            CACHE_REQUESTS.inc(cache="extraction", result="hit" if from_cache else "miss")
+            annotate(extraction_cache_hit=from_cache)
+            if not from_cache:
+                response = await call_llm_async(prompt, model=EXTRACTION_MODEL)
             
             # Parse response into JSON
             try:
                 result = json.loads(response)
                 
-                print(f"🔍 DATA EXTRACTION NODE: Result = {result}")
+                # Only cache responses that parsed, so a bad completion gets retried next turn
+                if not from_cache:
+                    await extraction_cache.aset(cache_key, response)
+                
+                logger.debug("🔍 DATA EXTRACTION NODE: Result (from cache: %s) = %s", from_cache, result)
                 
                 # Update inputs with extracted data
                 for key, value in result.items():
                     if key in inputs and value and value != "null":
                         inputs[key] = value
-                        print(f"🔍 DATA EXTRACTION NODE: Updated {key} = {value}")
+                        logger.debug("🔍 DATA EXTRACTION NODE: Updated %s = %s", key, value)
                         
                 # Update local variables
                 complaint_topic = inputs.get("complaint_topic", "")
                 complaint_location = inputs.get("complaint_location", "")
                 complaint_summary = inputs.get("complaint_summary", "")
                 complaint_quality = inputs.get("complaint_quality", 0)
+                conversation_summary = inputs.get("conversation_summary", "")
+                extracted_message_count = len(conversation_history)
+                extracted_prefix_hash = history_hash(conversation_history)
                                 
                 # If topic has just been generated AND there is a new topic AND it was not one of the existing topics, generate a new topic document
                 if to_generate_topic and inputs.get("complaint_topic", "") and (inputs.get("complaint_topic", "") not in topic_list):
-                    # Create a new topic document in the 'topics' collection
-                    
-                    new_topic_ref = topics_ref.document()
-                    new_topic_data = {
-                        "topic": complaint_topic,
-                        "summary": complaint_summary,
-                        "imageURL": "https://firebasestorage.googleapis.com/v0/b/complainsg-b0b10.firebasestorage.app/o/Default_Cuphead.png?alt=media"
-                    }
-                    new_topic_ref.set(new_topic_data)
-                    print(f"🔍 DATA EXTRACTION NODE: Created new topic document = {new_topic_data}")
+                    # Reuse a near-duplicate of an existing topic instead of growing the catalog
+                    existing_topic = await topic_catalog.match_topic(complaint_topic)
+                    if existing_topic:
+                        logger.info("🔍 DATA EXTRACTION NODE: Matched existing topic", extra=fields(topic=complaint_topic, matched=existing_topic))
+                        complaint_topic = inputs["complaint_topic"] = existing_topic
+                    else:
+                        # Create a new topic document in the 'topics' collection (also updates the catalog cache)
+                        new_topic_data = await topic_catalog.add_topic(complaint_topic, complaint_summary)
+                        logger.info("🔍 DATA EXTRACTION NODE: Created new topic document", extra=fields(topic=new_topic_data["topic"]))
                         
             except json.JSONDecodeError:
-                print("❌ DATA EXTRACTION NODE: Failed to parse JSON response from LLM")
-                print(f"❌ DATA EXTRACTION NODE: Raw response was: {response}")
-                return "continue"
+                # Keep the metadata we already had, post_async will route to 'continue'
+                logger.warning("❌ DATA EXTRACTION NODE: Failed to parse JSON response from LLM: %r", response)
             
         result = {
             "complaint_topic": complaint_topic,
             "complaint_location": complaint_location,
             "complaint_summary": complaint_summary,
             "complaint_quality": complaint_quality,
+            "conversation_summary": conversation_summary,
+            "extracted_message_count": extracted_message_count,
+            "extracted_prefix_hash": extracted_prefix_hash,
             "has_been_summarized": has_been_summarized
         }
         return result
     
     async def post_async(self, shared, prep_res, exec_res):
         
-        print(f"🔍 DATA EXTRACTION NODE: complaint_quality (post LLM) = {exec_res.get('complaint_quality')}")
+        logger.debug("🔍 DATA EXTRACTION NODE: complaint_quality (post LLM) = %s", exec_res.get('complaint_quality'))
         
         # Populate task metadata with extracted data
         shared["task_metadata"]["complaint_topic"] = exec_res.get("complaint_topic")
         shared["task_metadata"]["complaint_location"] = exec_res.get("complaint_location")
         shared["task_metadata"]["complaint_summary"] = exec_res.get("complaint_summary")
         shared["task_metadata"]["complaint_quality"] = exec_res.get("complaint_quality")
+        shared["task_metadata"]["conversation_summary"] = exec_res.get("conversation_summary", "")
+        shared["task_metadata"]["extracted_message_count"] = exec_res.get("extracted_message_count", 0)
+        shared["task_metadata"]["extracted_prefix_hash"] = exec_res.get("extracted_prefix_hash", "")
         
         if exec_res.get("has_been_summarized"):
             return "reject"
         
-        print(f"🔍 DATA EXTRACTION NODE: task_metadata = {shared['task_metadata']}")
-        if exec_res.get("complaint_topic") and exec_res.get("complaint_location") and exec_res.get("complaint_summary") and exec_res.get("complaint_quality") > complaint_threshold:
-            print("🔍 DATA EXTRACTION NODE: All fields complete - returning 'end'")
-            return "summarize"
-        else:
-            print("🔍 DATA EXTRACTION NODE: Some fields missing - returning 'continue'")
-            return 'continue'
+        logger.debug("🔍 DATA EXTRACTION NODE: task_metadata = %s", shared['task_metadata'])
+        action = route_after_extraction(shared["task_metadata"])
+        logger.info("🔍 DATA EXTRACTION NODE: routing to %s", action, extra=fields(action=action, task_id=shared.get("task_id")))
+        return action
 
 
 class HTTPGenerateNodeAsync(AsyncNode):
@@ -179,12 +239,16 @@ class HTTPGenerateNodeAsync(AsyncNode):
             "complaint_summary": shared.get("task_metadata", {}).get("complaint_summary", ""),
             "complaint_location": shared.get("task_metadata", {}).get("complaint_location", ""),
             "complaint_quality": shared.get("task_metadata", {}).get("complaint_quality", 0),
+            # Stands in for messages that don't fit the history budget
+            "conversation_summary": shared.get("task_metadata", {}).get("conversation_summary", ""),
             "queue": shared.get("message_queue")
         }
         return inputs
     async def exec_async(self, inputs):
         
         queue = inputs.get("queue")
+        history = build_history(inputs["conversation_history"], summary=inputs.get("conversation_summary", ""))
+        report_savings("generate", history)
         
         missing_fields = [key for key, value in inputs.items() if key in ['complaint_topic', 'complaint_location', 'complaint_summary'] and not value]
         
@@ -192,7 +256,8 @@ class HTTPGenerateNodeAsync(AsyncNode):
         prompt = f"""
             You are a helpful assistant that is trying to understand a citizen complaint by asking a single question
             
-            Past conversation history: {inputs['conversation_history']}
+            Past conversation history:
+            {history.text}
 
             Missing Data: {', '.join(missing_fields)}
             Complaint Quality: {inputs.get("complaint_quality", 0)}
@@ -202,13 +267,15 @@ class HTTPGenerateNodeAsync(AsyncNode):
             Suggest the next clarifying question to better understand the complaint and to get the data I want. Only output the question.
             """
         full_response = ""
+        # Batch tiny deltas before they hit the task channel
+        out = ChunkCoalescer(queue) if queue else None
         async for chunk in stream_llm_async([{"role": "user", "content": prompt}]):
             if chunk:
                 full_response += chunk
-                if queue:
-                    await queue.put(chunk)
-        if queue:
-            await queue.put(None)
+                if out:
+                    await out.put(chunk)
+        if out:
+            await out.put(None)
         return full_response
     async def post_async(self, shared, prep_res, exec_res):
         shared["conversation_history"].append({"role": "assistant", "content": exec_res})
@@ -218,26 +285,32 @@ class HTTPSummarizerNodeAsync(AsyncNode):
     async def prep_async(self, shared):
         return {
             "conversation_history": shared["conversation_history"],
+            # Updated by extraction earlier in this flow, stands in for messages that don't fit the budget
+            "conversation_summary": shared.get("task_metadata", {}).get("conversation_summary", ""),
             "queue": shared.get("message_queue")
         }
     async def exec_async(self, inputs):
+        history = build_history(inputs["conversation_history"], summary=inputs.get("conversation_summary", ""))
+        report_savings("summarizer", history)
         prompt = f"""
             You are summarizing a citizen complaint conversation for processing by a government agency.
 
             Conversation history:
-            {inputs["conversation_history"]}
+            {history.text}
 
             Write a short, clear summary of the complaint as a single paragraph. Start the parapgraph with: Your complaint has been logged!
             """
         full_response = ""
         queue = inputs.get("queue")
+        # Batch tiny deltas before they hit the task channel
+        out = ChunkCoalescer(queue) if queue else None
         async for chunk in stream_llm_async([{"role": "user", "content": prompt}]):
             if chunk:
                 full_response += chunk
-                if queue:
-                    await queue.put(chunk)
-        if queue:
-            await queue.put(None)
+                if out:
+                    await out.put(chunk)
+        if out:
+            await out.put(None)
         return full_response
     async def post_async(self, shared, prep_res, exec_res):
         return "default"
@@ -249,26 +322,103 @@ class HTTPRejectionNodeAsync(AsyncNode):
     
     async def exec_async(self, inputs):        
         # Response text
-        response_text = "This complaint thread has ended. Create a new chat if you want to start anther complaint!"
+        response_text = CANNED_RESPONSES[REJECT]
         
         queue = inputs.get("queue")
-        full_response = ""
         
-        # Fake streaming response lol more vibes then j throwing up a wall of text
+        # Sent in one go, no point holding the connection open to fake a stream
         if queue:
-            # Split the response into words
-            words = response_text.split()
-            # Put each word into the queue with a small delay
-            for word in words:
-                word_with_space = word + " "
-                full_response += word_with_space
-                await queue.put(word_with_space)
-                await asyncio.sleep(0.1)  # Small delay to simulate streaming
-            
+            await queue.put(response_text)
             # Signal end of stream
             await queue.put(None)
         
         return response_text
     
     async def post_async(self, shared, prep_res, exec_res):
-        return "default"
\ No newline at end of file
+        return "default"
+
+def _discard_generation(generation):
+    # cancel() is a no-op once the speculative stream has failed, so retrieve its error here
+    # instead of leaving "Task exception was never retrieved" for asyncio to log
+    generation.cancel()
+    generation.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+
+class HTTPSpeculativeExtractionNodeAsync(AsyncNode):
+    """
+    Runs extraction and the clarifying-question stream at the same time.
+    The question is streamed into a private buffer and only handed to the client (by
+    HTTPSpeculativeCommitNodeAsync) if extraction routes to 'continue', otherwise it is cancelled.
+    The speculative question is generated from the metadata the client sent, not the freshly extracted one.
+    """
+    def __init__(self):
+        super().__init__()
+        self.extraction = HTTPDataExtractionNodeAsync()
+        self.generate = HTTPGenerateNodeAsync()
+
+    async def prep_async(self, shared):
+        generate_inputs = await self.generate.prep_async(shared)
+        # Copy the history since generation's post appends to it
+        generate_inputs["conversation_history"] = list(generate_inputs["conversation_history"])
+        return {
+            "extraction": await self.extraction.prep_async(shared),
+            "generate": generate_inputs,
+        }
+
+    async def exec_async(self, inputs):
+        buffer = asyncio.Queue()
+        generation = asyncio.create_task(self.generate.exec_async({**inputs["generate"], "queue": buffer}))
+        try:
+            extraction_res = await self.extraction.exec_async(inputs["extraction"])
+        except BaseException:
+            _discard_generation(generation)
+            raise
+        return {"extraction": extraction_res, "generation": generation, "buffer": buffer}
+
+    async def post_async(self, shared, prep_res, exec_res):
+        generation = exec_res["generation"]
+        try:
+            action = await self.extraction.post_async(shared, prep_res["extraction"], exec_res["extraction"])
+        except BaseException:
+            _discard_generation(generation)
+            raise
+        if action == "continue":
+            shared["speculative_generation"] = {"task": generation, "buffer": exec_res["buffer"]}
+        else:
+            logger.info("🔮 SPECULATIVE NODE: Extraction routed to %s, cancelling speculative question", action)
+            _discard_generation(generation)
+        return action
+
+
+class HTTPSpeculativeCommitNodeAsync(AsyncNode):
+    async def prep_async(self, shared):
+        return {
+            "speculation": shared.pop("speculative_generation"),
+            "queue": shared.get("message_queue"),
+        }
+
+    async def exec_async(self, inputs):
+        buffer = inputs["speculation"]["buffer"]
+        generation = inputs["speculation"]["task"]
+        queue = inputs.get("queue")
+        # Forward whatever was already generated, then the rest as it arrives (None ends the stream)
+        while True:
+            get_chunk = asyncio.ensure_future(buffer.get())
+            done, _ = await asyncio.wait({get_chunk, generation}, return_when=asyncio.FIRST_COMPLETED)
+            if get_chunk not in done:
+                get_chunk.cancel()
+                # Generation finished (or failed) without us seeing its sentinel yet
+                if buffer.empty():
+                    generation.result()
+                    break
+                continue
+            chunk = get_chunk.result()
+            if queue:
+                await queue.put(chunk)
+            if chunk is None:
+                break
+        return await generation
+
+    async def post_async(self, shared, prep_res, exec_res):
+        shared["conversation_history"].append({"role": "assistant", "content": exec_res})
+        return "default"
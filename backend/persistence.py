@@ -0,0 +1,95 @@
+# persistence.py
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import firebase_config
+
+# firebase_admin's Firestore client is blocking, so every call goes through this bounded pool
+# instead of running on the event loop (which would stall every other SSE stream)
+FIRESTORE_MAX_WORKERS = int(os.environ.get("FIRESTORE_MAX_WORKERS", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=FIRESTORE_MAX_WORKERS, thread_name_prefix="firestore")
+
+
+async def run_blocking(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+def _init():
+    firebase_config.get_db()
+
+
+def _list_topics(collection):
+    return [doc.to_dict() for doc in firebase_config.get_db().collection(collection).stream()]
+
+
+def _create_topic(collection, data):
+    new_topic_ref = firebase_config.get_db().collection(collection).document()
+    new_topic_ref.set(data)
+    return new_topic_ref.id
+
+
+def _watch_collection(collection, callback):
+    return firebase_config.get_db().collection(collection).on_snapshot(callback)
+
+
+def _list_documents(collection):
+    return [(doc.id, doc.to_dict()) for doc in firebase_config.get_db().collection(collection).stream()]
+
+
+def _merge_topic(duplicate_id, duplicate_topic, canonical_topic, topics_collection, threads_collection):
+    # Re-point threads at the canonical topic (Firestore batches cap at 500 writes), then drop the duplicate.
+    # Exact-name duplicates have nothing to re-point.
+    from google.cloud.firestore_v1 import FieldFilter
+
+    db = firebase_config.get_db()
+    threads = []
+    if duplicate_topic != canonical_topic:
+        threads = db.collection(threads_collection).where(filter=FieldFilter("topic", "==", duplicate_topic)).stream()
+    batch = db.batch()
+    pending = 0
+    moved = 0
+    for thread in threads:
+        batch.update(thread.reference, {"topic": canonical_topic, "title": canonical_topic})
+        pending += 1
+        moved += 1
+        if pending == 500:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    batch.delete(db.collection(topics_collection).document(duplicate_id))
+    batch.commit()
+    return moved
+
+
+async def init():
+    # Credentials + client setup does blocking I/O, so it runs on the pool too
+    await run_blocking(_init)
+
+
+async def list_topics(collection="topics"):
+    return await run_blocking(_list_topics, collection)
+
+
+async def create_topic(data, collection="topics"):
+    return await run_blocking(_create_topic, collection, data)
+
+
+async def list_documents(collection):
+    return await run_blocking(_list_documents, collection)
+
+
+async def merge_topic(duplicate_id, duplicate_topic, canonical_topic, topics_collection="topics", threads_collection="threads"):
+    return await run_blocking(_merge_topic, duplicate_id, duplicate_topic, canonical_topic, topics_collection, threads_collection)
+
+
+async def watch_collection(collection, callback):
+    # The callback is invoked from Firestore's own watch thread, not the event loop
+    return await run_blocking(_watch_collection, collection, callback)
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,115 @@
+# prompt_window.py
+# Shared conversation-history assembly for the prompt builders (generate, summarizer, extraction).
+# History goes in as a compact "role: content" transcript under a token budget: the most recent
+# messages are kept verbatim, older ones are clipped, and whatever no longer fits is replaced by the
+# rolling conversation summary (kept up to date by incremental extraction) or an omission note.
+import hashlib
+import json
+import os
+
+from utils import count_tokens, format_message, truncate_tokens
+from log import get_logger, fields
+from metrics import PROMPT_HISTORY_TOKENS, PROMPT_TOKENS_SAVED, annotate
+
+logger = get_logger("prompt_window")
+
+# Token budget for the history block of a prompt
+PROMPT_HISTORY_BUDGET = int(os.environ.get("PROMPT_HISTORY_BUDGET", "1500"))
+# Newest messages that are never clipped
+PROMPT_RECENT_MESSAGES = int(os.environ.get("PROMPT_RECENT_MESSAGES", "6"))
+# Older messages are clipped to this many tokens each
+PROMPT_OLDER_MESSAGE_TOKENS = int(os.environ.get("PROMPT_OLDER_MESSAGE_TOKENS", "200"))
+
+
+class PromptHistory:
+    def __init__(self, text, tokens, raw_tokens, kept, truncated, dropped):
+        self.text = text
+        self.tokens = tokens
+        # What embedding the raw message list (the old prompts) would have cost
+        self.raw_tokens = raw_tokens
+        self.kept = kept
+        self.truncated = truncated
+        self.dropped = dropped
+
+    @property
+    def saved_tokens(self):
+        return max(self.raw_tokens - self.tokens, 0)
+
+
+def build_history(
+    messages,
+    summary="",
+    baseline=None,
+    budget=PROMPT_HISTORY_BUDGET,
+    recent=PROMPT_RECENT_MESSAGES,
+    older_message_tokens=PROMPT_OLDER_MESSAGE_TOKENS,
+):
+    """
+    Render `messages` newest-first into the budget, then put them back in order.
+    `summary` stands in for dropped messages. `baseline` is the message list the savings are
+    measured against, when that differs from `messages` (e.g. incremental extraction's delta).
+    """
+    raw_tokens = count_tokens(str(messages if baseline is None else baseline))
+    summary_line = f"Summary of earlier messages: {summary}" if summary else ""
+    available = budget - count_tokens(summary_line)
+
+    lines = []
+    used = 0
+    truncated = 0
+    for position, message in enumerate(reversed(messages)):
+        line = format_message(message)
+        tokens = count_tokens(line)
+        if position >= recent and tokens > older_message_tokens:
+            line = truncate_tokens(line, older_message_tokens) + " [...]"
+            tokens = count_tokens(line)
+            truncated += 1
+        # The newest message always goes in, even on its own it is over budget
+        if lines and used + tokens > available:
+            break
+        lines.append(line)
+        used += tokens
+
+    dropped = len(messages) - len(lines)
+    if dropped:
+        lines.append(summary_line or f"[{dropped} earlier messages omitted]")
+    lines.reverse()
+    text = "\n".join(lines)
+    return PromptHistory(text, count_tokens(text), raw_tokens, len(messages) - dropped, truncated, dropped)
+
+
+def report_savings(node, history, **extra):
+    PROMPT_HISTORY_TOKENS.observe(history.tokens, node=node)
+    PROMPT_TOKENS_SAVED.inc(history.saved_tokens, node=node)
+    annotate(**{f"{node}_history_tokens": history.tokens, f"{node}_history_tokens_saved": history.saved_tokens})
+    logger.info(
+        "✂️ PROMPT WINDOW: %s history %d tokens (saved %d)", node, history.tokens, history.saved_tokens,
+        extra=fields(
+            node=node,
+            history_tokens=history.tokens,
+            raw_tokens=history.raw_tokens,
+            saved_tokens=history.saved_tokens,
+            kept=history.kept,
+            truncated=history.truncated,
+            dropped=history.dropped,
+            **extra,
+        ),
+    )
+
+
+def history_hash(messages):
+    # Fingerprint of the messages an extraction saw, sent back as threadMetaData.extractedPrefixHash
+    payload = json.dumps([[message.get("role"), message.get("content")] for message in messages], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def extraction_delta(messages, extracted_count, prefix_hash):
+    """
+    Messages added since the last extraction, or None when incremental extraction can't be trusted:
+    nothing new (the last message was edited or the reply regenerated), or the extracted prefix no
+    longer matches (edited / branched further back). The caller then extracts from the full history.
+    """
+    if not 0 < extracted_count < len(messages):
+        return None
+    if not prefix_hash or history_hash(messages[:extracted_count]) != prefix_hash:
+        return None
+    return messages[extracted_count:]
@@ -0,0 +1,126 @@
+# response_cache.py
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+# Set to a file path to keep cached responses across restarts
+LLM_CACHE_SQLITE_PATH = os.environ.get("LLM_CACHE_SQLITE_PATH", "")
+
+
+class ResponseCache:
+    """
+    Content-addressed cache for LLM responses.
+    Entries live in an in-memory LRU capped at `max_bytes`, optionally backed by a SQLite file.
+    Async code should use aget/aset, which keep SQLite reads and commits off the event loop.
+    """
+
+    def __init__(self, max_bytes=LLM_CACHE_MAX_BYTES, sqlite_path=None):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self._executor = None
+        if sqlite_path:
+            # One thread, so SQLite calls are serialized there rather than on the event loop
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-cache")
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(model, prompt, missing_fields=(), catalog_version=0):
+        # Collapse whitespace so indentation changes in the prompt template don't bust the cache
+        normalized_prompt = " ".join(prompt.split())
+        payload = json.dumps([model, normalized_prompt, sorted(missing_fields), catalog_version], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _size(key, value):
+        return len(key) + len(value.encode("utf-8"))
+
+    def _store(self, key, value):
+        if key in self._entries:
+            self._bytes -= self._size(key, self._entries.pop(key))
+        size = self._size(key, value)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = value
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            old_key, old_value = self._entries.popitem(last=False)
+            self._bytes -= self._size(old_key, old_value)
+            self.evictions += 1
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            if self._db is not None:
+                row = self._db.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._store(key, row[0])
+                    self.hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO responses (key, value) VALUES (?, ?)", (key, value))
+                self._db.commit()
+
+    async def aget(self, key):
+        if self._db is None:
+            return self.get(key)
+        # Memory hits don't need the SQLite thread
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.get, key)
+
+    async def aset(self, key, value):
+        if self._db is None:
+            return self.set(key, value)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.set, key, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "sqlite": self._db is not None,
+            }
+
+
+# Shared cache for the extraction node's JSON responses
+extraction_cache = ResponseCache(sqlite_path=LLM_CACHE_SQLITE_PATH or None)
@@ -0,0 +1,68 @@
+# routing.py
+# Pure routing decisions for the chat flow. No I/O here, so these can run before any
+# Firestore/LLM work and be reasoned about (and tested) on plain dicts.
+
+# If the complaint quality is at or below this threshold, it will try to atttempt to ask more questions
+complaint_threshold = 4
+
+REQUIRED_FIELDS = ("complaint_topic", "complaint_location", "complaint_summary")
+
+# Actions
+REJECT = "reject"
+SUMMARIZE = "summarize"
+CONTINUE = "continue"
+NEEDS_EXTRACTION = "extract"
+
+
+def parse_quality(value):
+    # The LLM sometimes returns the quality as a string ("4") or null
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def is_complete(metadata):
+    return all(metadata.get(field) for field in REQUIRED_FIELDS) and parse_quality(metadata.get("complaint_quality")) > complaint_threshold
+
+
+def missing_fields(metadata):
+    missing = [field for field in REQUIRED_FIELDS if not metadata.get(field)]
+    if parse_quality(metadata.get("complaint_quality")) <= complaint_threshold:
+        missing.append("complaint_quality")
+    return missing
+
+
+def route_thread(metadata):
+    """
+    Decide from the thread metadata alone what this turn needs.
+    A thread arriving complete was summarized on the turn it became complete, so it is rejected.
+    """
+    if is_complete(metadata):
+        return REJECT
+    return NEEDS_EXTRACTION
+
+
+def route_after_extraction(metadata):
+    if is_complete(metadata):
+        return SUMMARIZE
+    return CONTINUE
+
+
+# Admission priorities (lower runs first, see admission.py)
+PRIORITY_SUMMARIZE = 0
+PRIORITY_CONTINUE = 1
+PRIORITY_NEW_THREAD = 2
+
+
+def flow_priority(metadata):
+    """
+    Guess, before extraction runs, how far along the thread is.
+    A thread missing at most one field is likely to be summarized this turn; one that has
+    nothing extracted yet is a new conversation and waits behind the ones already underway.
+    """
+    if len(missing_fields(metadata)) <= 1:
+        return PRIORITY_SUMMARIZE
+    if not any(metadata.get(field) for field in REQUIRED_FIELDS) and not metadata.get("extracted_message_count"):
+        return PRIORITY_NEW_THREAD
+    return PRIORITY_CONTINUE
@@ -1,22 +1,52 @@
 import asyncio
-import json
 import uuid
+from contextlib import asynccontextmanager
 from time import sleep
 
-from fastapi import FastAPI, Request, WebSocket, BackgroundTasks
+from fastapi import FastAPI, Request, WebSocket, BackgroundTasks, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, Response, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from flow import generate_or_summarize_flow
+from llm_clients import close_clients
+from llm_router import llm_router
+from topic_catalog import topic_catalog
+from response_cache import extraction_cache
+from task_registry import task_registry, turn_key, TooManyTasks
+from coalesce import read_batch
+from canned_responses import CANNED_RESPONSES, DONE_FRAME, FLOW_FAILED, encode_canned, metadata_frame, sse_frame
+from routing import flow_priority, route_thread, REJECT
+from admission import admission, start_turn
+import persistence
+from log import get_logger, fields
+from metrics import annotate, register_gauges, render_metrics, start_trace, get_trace
 
-app = FastAPI()
+logger = get_logger("server")
 
-# Dictionary to hold queues for different tasks
-task_queues = {}
-# Dictionary to hold metadata for different tasks
-task_metadata = {}
-# Lock to prevent race conditions when creating tasks
-task_creation_lock = asyncio.Lock()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Expires tasks whose stream was never (or no longer) read
+    reaper = asyncio.create_task(task_registry.run_reaper())
+    # Firestore and the topic catalog are set up here instead of at import, so cold starts stay fast
+    try:
+        await persistence.init()
+        await topic_catalog.get_topics()
+    except Exception:
+        logger.exception("❌ STARTUP: Firestore initialization failed, will retry on first use")
+    # Open LLM connections now rather than on the first turn
+    await llm_router.prewarm()
+    yield
+    reaper.cancel()
+    await task_registry.broker.close()
+    # Release pooled LLM connections, the topics listener and the Firestore threads
+    await close_clients()
+    topic_catalog.close()
+    persistence.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+# Queues and metadata for the different tasks live in task_registry.
+# Registry operations never await, so they are atomic on the event loop and need no lock.
 
 # List of allowed origins (your frontend URL)
 origins = [
@@ -34,8 +64,34 @@ app.add_middleware(
 )
 
 async def run_flow(shared_store: dict):
+    task_id = shared_store["task_id"]
+    entry = task_registry.get(task_id)
+    if entry is None:
+        # Expired before the flow got to start
+        return
     flow = generate_or_summarize_flow()
-    await flow.run_async(shared_store)
+    # Set before the task is created so the flow's spans land in this task's trace, and its LLM
+    # requests queue for the global limit at this turn's priority (summarize ahead of new threads)
+    start_trace(task_id)
+    start_turn(shared_store["priority"], entry.metadata)
+    # Run the flow as its own task so the registry can cancel it if the task expires
+    entry.flow_task = asyncio.create_task(flow.run_async(shared_store))
+    try:
+        await entry.flow_task
+    except asyncio.CancelledError:
+        if not entry.flow_task.cancelled():
+            raise
+        logger.info("🧹 Flow cancelled", extra=fields(task_id=task_id))
+    except Exception:
+        # Tell the reader instead of leaving its stream open with no end
+        logger.exception("❌ Flow failed", extra=fields(task_id=task_id))
+        task_registry.forget_turn(task_id)
+        await entry.channel.end(FLOW_FAILED)
+    finally:
+        annotate(queue_wait_ms=entry.metadata["queue_wait_ms"], priority=shared_store["priority"])
+        # With a shared broker the SSE reader may be on another worker and never clean up our entry
+        if not task_registry.broker.is_local:
+            task_registry.remove(task_id)
 
 # Kick off flow for existing task
 # The curently way of procesing metadata is having the serve send the thread metadata store back to the client (even if it empty)
@@ -48,104 +104,182 @@ async def chat_endpoint(request: Request, background_tasks: BackgroundTasks):
     # Task ID for client reference
     task_id = f"task_{uuid.uuid4().hex[:8]}"
     
-    # Use lock to prevent race conditions
-    async with task_creation_lock:
-        # Check if task queue exists, if not create it
-        if task_id not in task_queues:
-            print(f"Task {task_id} queue not found, creating it...")
-            message_queue = asyncio.Queue()
-            task_queues[task_id] = message_queue
-            print(f"✅ Created new queue for task {task_id}")
-        else:
-            raise Exception(f"Task {task_id} already exists")
-            
     # Populate dictionary with task metadata from POST
-    print(f"🔍 DATA: {data}")
+    logger.debug("🔍 DATA: %s", data)
     
-    task_metadata[task_id] = {
+    metadata = {
         "complaint_topic": data.get("threadMetaData", {}).get("topic", ""),
         "complaint_summary": data.get("threadMetaData", {}).get("summary", ""),
         "complaint_location": data.get("threadMetaData", {}).get("location", ""),
         "complaint_quality": data.get("threadMetaData", {}).get("quality", 0),
+        # Incremental extraction state: rolling summary, how many messages were already extracted from, and their hash
+        "conversation_summary": data.get("threadMetaData", {}).get("conversationSummary", ""),
+        "extracted_message_count": data.get("threadMetaData", {}).get("extractedMessageCount", 0),
+        "extracted_prefix_hash": data.get("threadMetaData", {}).get("extractedPrefixHash", ""),
     }
     
+    # Completed threads get the canned reply and never run a flow, so only real turns are shared
+    canned = route_thread(metadata) == REJECT
+    key = None
+    if not canned:
+        key = turn_key(data.get("messages", []), data.get("threadMetaData", {}))
+        running = task_registry.find_inflight(key)
+        if running is not None:
+            # Same turn already being answered (retry / double submit), share its stream instead of paying for the LLM again
+            logger.info("🔗 Duplicate turn, attaching to running task", extra=fields(task_id=running.task_id))
+            return {"task_id": running.task_id}
+    
+    try:
+        entry = task_registry.create(task_id, metadata, turn_key=key)
+    except TooManyTasks as e:
+        # Shed load instead of queueing more flows than we can serve
+        logger.warning("❌ Rejecting task: %s", e, extra=fields(task_id=task_id))
+        raise HTTPException(status_code=429, detail="Too many active chats, please try again shortly")
+    await entry.channel.open()
+    
+    # Completed threads always get the same reply, so skip the flow entirely
+    if canned:
+        logger.info("⚡ Completed thread, serving canned rejection", extra=fields(task_id=task_id))
+        entry.canned = REJECT
+        if not task_registry.broker.is_local:
+            # The SSE GET may land on another worker, which can only see the channel
+            await entry.channel.put(CANNED_RESPONSES[REJECT])
+            await entry.channel.put(None)
+            task_registry.remove(task_id)
+        return {"task_id": task_id}
+    
     # Define all shared parameters here and kick off the flow
     shared_store = {    
         "conversation_history": data.get("messages", []),
-        # Reference to queue for streaming response (for that id)
-        "message_queue": message_queue,
+        # Reference to the broker channel for streaming response (for that id)
+        "message_queue": entry.channel,
         "task_id": task_id,
         "status": "continue",
         # Reference to dictionary (for that id)
-        "task_metadata": task_metadata[task_id],
+        "task_metadata": entry.metadata,
+        # Priority of this turn's LLM requests in the admission queue (see routing.flow_priority)
+        "priority": flow_priority(metadata),
     }
     
-    print(f"🚀 Starting background flow for task {task_id}")
+    logger.info("🚀 Starting background flow", extra=fields(task_id=task_id, messages=len(data.get("messages", []))))
     background_tasks.add_task(run_flow, shared_store)
     return {"task_id": task_id}
 
 # SSE endpoint to receive streaming response from the queue for a specific task
 @app.get("/api/chat/stream/{task_id}")
-async def stream_endpoint(task_id: str):
+async def stream_endpoint(request: Request, task_id: str, last_event_id: str | None = Header(default=None)):
     """
     This endpoint returns the streaming response from the queue for a specific task.
-    If the task doesn't exist, it creates the task ID and queue but doesn't run the flow.
+    Unknown (or expired) task ids get a 404 instead of a queue that nothing will ever write to.
+    The task may be running on another worker when a shared (Redis) broker is configured.
+    A client that dropped mid-stream can reconnect with a Last-Event-ID header (or ?last_event_id=)
+    and get the rest of the answer replayed, without the flow running again.
     """
-    print(f"📥 GET /api/chat/stream/{task_id} - Current tasks: {list(task_queues.keys())}")
-    
-    # Use lock to prevent race conditions
-    async with task_creation_lock:
-        # If task doesn't exist, create the queue only (no flow execution)
-        if task_id not in task_queues:
-            print(f"Task {task_id} not found, creating queue...")
-            message_queue = asyncio.Queue()
-            task_queues[task_id] = message_queue
-            print(f"✅ Queue created for task {task_id}")
-        else:
-            print(f"✅ Task {task_id} already exists")
-        if task_id not in task_metadata:
-            print(f"Task {task_id} not found, creating metadata...")
-            task_metadata[task_id] = {
-                "complaint_topic": "",
-                "complaint_quality": 0,
-                "complaint_summary": "",
-                "complaint_location": ""
-            }
-            print(f"✅ Metadata created for task {task_id}")
+    # fetch() based clients can't set Last-Event-ID on a plain GET as easily, so accept it as a query param too
+    last_event_id = last_event_id or request.query_params.get("last_event_id")
+    entry = task_registry.get(task_id)
+    if entry is not None:
+        entry.touch()
+        channel = entry.channel
+    else:
+        channel = await task_registry.broker.attach(task_id)
+    if channel is None:
+        raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
+
+    # Canned replies are pre-encoded, send the whole stream in a single write
+    if entry is not None and entry.canned:
+        body = encode_canned(entry.canned, entry.metadata)
+        task_registry.remove(task_id)
+        await channel.close()
+        return Response(content=body, media_type="text/event-stream")
+
+    reader = channel.reader(last_event_id)
+    if reader is None:
+        # Already dropped out of the replay buffer
+        raise HTTPException(status_code=410, detail=f"Cannot resume task {task_id} from event {last_event_id}")
 
     async def stream_generator():
-        queue = task_queues[task_id]
-        print(f"🔄 Starting stream for task {task_id}")
+        logger.info("🔄 Starting stream", extra=fields(task_id=task_id, last_event_id=last_event_id))
+        completed = False
         try:
             while True:
-                message = await queue.get()
+                # Everything already queued (or arriving within the coalescing window) goes out as one frame
+                message, ended, chunk_id = await read_batch(reader)
+                if message:
+                    yield sse_frame({'content': message}, chunk_id)
                 # If message is done, queue will have None at the end
-                if message is None:
-                    print(f"🏁 End of stream for task {task_id}")
+                if ended:
+                    logger.info("🏁 End of stream", extra=fields(task_id=task_id))
+                    if reader.error:
+                        # The flow failed or the task expired, the frontend shows this instead of waiting
+                        yield sse_frame({'error': reader.error})
                     
                     # Metadata is generated before stream, but only retrieve after stream is done to prevent race condition
-                    stored_metadata = task_metadata.get(task_id, {})
-                    metadata = {
-                        "type": "metadata",
-                        "threadMetaData": stored_metadata
-                    }
+                    stored_metadata = reader.metadata
                     
-                    print(f"🔍 Sending metadata: {metadata}")
-                    yield f"data: {json.dumps(metadata)}\n\n"
+                    logger.debug("🔍 Sending metadata: %s", stored_metadata)
+                    yield metadata_frame(stored_metadata, reader.last_id)
                     # Sentinel to indicate the end of the stream
-                    yield f"data: {json.dumps({'done': True})}\n\n"
+                    yield DONE_FRAME
+                    completed = True
                     break
-                yield f"data: {json.dumps({'content': message})}\n\n"
-                queue.task_done()
         finally:
-            # Clean up the queue and metadata
-            if task_id in task_queues:
-                print(f"🧹 Cleaning up task {task_id}")
-                del task_queues[task_id]
-            if task_id in task_metadata:
-                print(f"🧹 Cleaning up metadata for task {task_id}")
-                del task_metadata[task_id]
+            if completed:
+                # Clean up the queue and metadata once every subscriber of this task has its answer.
+                # Readers attached from another worker leave the shared stream to expire on its own.
+                if task_registry.release(task_id):
+                    logger.debug("🧹 Cleaning up task", extra=fields(task_id=task_id))
+                    await channel.close()
+            else:
+                # Client went away mid-stream, keep the task (until it expires) so it can resume
+                logger.info("🔌 Client left mid-stream, keeping task for resume", extra=fields(task_id=task_id, last_event_id=reader.last_id))
 
     return StreamingResponse(stream_generator(), media_type="text/event-stream")
 
+# Scrape-time gauges next to the flow / LLM histograms
+def _gauges():
+    tasks = task_registry.metrics()
+    cache = extraction_cache.stats()
+    llm_slots = admission.stats()
+    return {
+        "tasks_live": tasks["live_tasks"],
+        "tasks_queued_chunks": tasks["queued_chunks"],
+        "tasks_inflight_turns": tasks["inflight_turns"],
+        "extraction_cache_entries": cache["entries"],
+        "extraction_cache_bytes": cache["bytes"],
+        "topic_catalog_version": topic_catalog.version,
+        "llm_slots_active": llm_slots["active"],
+        "llm_slots_queued": llm_slots["queued"],
+    }
+
+register_gauges(_gauges)
+
+# Prometheus-style metrics: node phase durations, LLM latency / TTFT / tokens, cache hits, routing actions
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+# Per-task span trace (only recorded with FLOW_TRACES=1)
+@app.get("/api/traces/{task_id}")
+async def trace_endpoint(task_id: str):
+    trace = get_trace(task_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"No trace for task {task_id}")
+    return trace
+
+# Circuit breaker state and in-flight requests per LLM provider
+@app.get("/api/llm/providers")
+async def llm_providers_endpoint():
+    return llm_router.status()
+
+# Live task count, queue depths and LLM admission
+@app.get("/api/tasks/metrics")
+async def task_metrics_endpoint():
+    return {**task_registry.metrics(), "admission": admission.stats()}
+
+# Hit/miss counters for the extraction response cache
+@app.get("/api/cache/stats")
+async def cache_stats_endpoint():
+    return {"extraction": extraction_cache.stats(), "topic_catalog_version": topic_catalog.version}
+
 app.mount("/", StaticFiles(directory="../frontend/out", html=True), name="frontend")
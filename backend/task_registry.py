@@ -0,0 +1,164 @@
+# task_registry.py
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+from broker import create_broker
+from canned_responses import TASK_EXPIRED
+from log import get_logger
+
+logger = get_logger("tasks")
+
+# Caps so abandoned chats can't grow server memory without bound
+MAX_ACTIVE_TASKS = int(os.environ.get("MAX_ACTIVE_TASKS", "1000"))
+# Max chunks buffered per task before the flow has to wait for the SSE reader
+TASK_QUEUE_SIZE = int(os.environ.get("TASK_QUEUE_SIZE", "256"))
+# A task nobody has read from for this long is dropped (and its flow cancelled)
+TASK_TTL = float(os.environ.get("TASK_TTL", "120"))
+TASK_REAP_INTERVAL = float(os.environ.get("TASK_REAP_INTERVAL", "10"))
+
+
+class TooManyTasks(Exception):
+    pass
+
+
+def turn_key(messages, thread_metadata):
+    # Identical POSTs (retries, double submits) hash to the same key
+    payload = json.dumps({"messages": messages, "threadMetaData": thread_metadata}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TaskEntry:
+    def __init__(self, task_id, channel):
+        self.task_id = task_id
+        # Broker channel the flow streams into (asyncio.Queue-like: put/get)
+        self.channel = channel
+        self.metadata = channel.metadata
+        self.created_at = time.monotonic()
+        self.last_active = self.created_at
+        # Set once the flow coroutine starts, so expiry can cancel it
+        self.flow_task = None
+        # Key into CANNED_RESPONSES when the reply is fixed and no flow runs
+        self.canned = None
+        # Set when duplicate turns may attach to this task
+        self.turn_key = None
+        # POSTs sharing this task, it is removed once each of them has read the full stream
+        self.subscribers = 1
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def idle_for(self, now):
+        # Chunks going through the channel count as activity too
+        return now - max(self.last_active, self.channel.last_active)
+
+
+class TaskRegistry:
+    def __init__(self, broker, max_tasks=MAX_ACTIVE_TASKS, queue_size=TASK_QUEUE_SIZE, ttl=TASK_TTL):
+        self.broker = broker
+        self.max_tasks = max_tasks
+        self.queue_size = queue_size
+        self.ttl = ttl
+        self._tasks = {}
+        # turn_key -> task_id of the flow currently answering that exact turn
+        self._inflight = {}
+        self.created_total = 0
+        self.coalesced_total = 0
+        self.expired_total = 0
+        self.rejected_total = 0
+
+    def __contains__(self, task_id):
+        return task_id in self._tasks
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def create(self, task_id, metadata, turn_key=None):
+        # Create-if-absent. Nothing here awaits, so no other coroutine can interleave
+        # between the check and the insert.
+        if len(self._tasks) >= self.max_tasks:
+            self.rejected_total += 1
+            raise TooManyTasks(f"{len(self._tasks)} active tasks (max {self.max_tasks})")
+        entry = TaskEntry(task_id, self.broker.channel(task_id, metadata, self.queue_size))
+        if self._tasks.setdefault(task_id, entry) is not entry:
+            raise KeyError(f"Task {task_id} already exists")
+        self.created_total += 1
+        if turn_key is not None:
+            entry.turn_key = turn_key
+            self._inflight[turn_key] = task_id
+        return entry
+
+    def find_inflight(self, turn_key):
+        # Singleflight: a duplicate turn subscribes to the running task instead of starting its own flow
+        entry = self._tasks.get(self._inflight.get(turn_key))
+        if entry is not None:
+            entry.subscribers += 1
+            self.coalesced_total += 1
+        return entry
+
+    def forget_turn(self, task_id):
+        # A failed flow keeps serving its error to existing subscribers, but retries get a fresh flow
+        entry = self._tasks.get(task_id)
+        if entry is not None and entry.turn_key is not None and self._inflight.get(entry.turn_key) == task_id:
+            del self._inflight[entry.turn_key]
+
+    def get(self, task_id):
+        return self._tasks.get(task_id)
+
+    def remove(self, task_id):
+        self.forget_turn(task_id)
+        entry = self._tasks.pop(task_id, None)
+        # A flow still running here has lost its reader, stop it instead of letting it block on a full queue
+        if entry is not None and entry.flow_task is not None and not entry.flow_task.done():
+            entry.flow_task.cancel()
+        return entry
+
+    def release(self, task_id):
+        # One subscriber finished its stream, drop the task once all of them have
+        entry = self._tasks.get(task_id)
+        if entry is None:
+            return False
+        entry.subscribers -= 1
+        if entry.subscribers > 0:
+            return False
+        self.remove(task_id)
+        return True
+
+    async def reap(self):
+        now = time.monotonic()
+        expired = [task_id for task_id, entry in self._tasks.items() if entry.idle_for(now) > self.ttl]
+        entries = [self.remove(task_id) for task_id in expired]
+        self.expired_total += len(expired)
+        # End the streams too, or a reader still connected would wait on them forever
+        for entry in entries:
+            await entry.channel.end(TASK_EXPIRED)
+        return expired
+
+    async def run_reaper(self, interval=TASK_REAP_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            expired = await self.reap()
+            if expired:
+                logger.info("🧹 Reaped %d expired tasks", len(expired))
+
+    def metrics(self):
+        depths = [entry.channel.qsize() for entry in self._tasks.values()]
+        return {
+            "broker": type(self.broker).__name__,
+            "live_tasks": len(self._tasks),
+            "max_tasks": self.max_tasks,
+            "queue_size": self.queue_size,
+            "queued_chunks": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "full_queues": sum(1 for depth in depths if depth >= self.queue_size),
+            "inflight_turns": len(self._inflight),
+            "created_total": self.created_total,
+            "coalesced_total": self.coalesced_total,
+            "expired_total": self.expired_total,
+            "rejected_total": self.rejected_total,
+        }
+
+
+task_registry = TaskRegistry(create_broker())
@@ -0,0 +1,144 @@
+import asyncio
+import contextvars
+from types import SimpleNamespace
+
+from admission import AdmissionScheduler, start_turn
+from llm_router import LLMRouter, Provider
+from routing import PRIORITY_CONTINUE, PRIORITY_NEW_THREAD, PRIORITY_SUMMARIZE, flow_priority
+
+
+class InFlight:
+    # Requests in flight across every fake provider
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+
+
+class FakeCompletions:
+    def __init__(self, delay, in_flight):
+        self.delay = delay
+        self.in_flight = in_flight
+
+    async def create(self, model, messages, stream=False, **kwargs):
+        self.in_flight.active += 1
+        self.in_flight.peak = max(self.in_flight.peak, self.in_flight.active)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight.active -= 1
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="ok"))], usage=None)
+
+
+class FakeProvider(Provider):
+    def __init__(self, name, completions):
+        super().__init__(name, "http://fake", "key")
+        self._client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+    @property
+    def client(self):
+        return self._client
+
+
+async def turn(scheduler, name, priority, order, hold=0.01):
+    start_turn(priority, {})
+    await scheduler.acquire()
+    order.append(name)
+    await asyncio.sleep(hold)
+    scheduler.release()
+
+
+def spawn(coro):
+    # Each turn in its own context, like each run_flow
+    return asyncio.create_task(coro, context=contextvars.Context())
+
+
+def test_priority_order_and_cancelled_waiter():
+    async def scenario():
+        scheduler = AdmissionScheduler(limit=1, priority_step=5)
+        order = []
+        first = spawn(turn(scheduler, "first", PRIORITY_NEW_THREAD, order, hold=0.05))
+        await asyncio.sleep(0)
+        queued = [spawn(turn(scheduler, name, priority, order)) for name, priority in [
+            ("new", PRIORITY_NEW_THREAD), ("continue", PRIORITY_CONTINUE), ("summarize", PRIORITY_SUMMARIZE),
+        ]]
+        cancelled = spawn(turn(scheduler, "cancelled", PRIORITY_SUMMARIZE, order))
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        await asyncio.gather(first, *queued)
+        return order, scheduler.active
+
+    assert asyncio.run(scenario()) == (["first", "summarize", "continue", "new"], 0)
+
+
+def test_low_priority_is_not_starved():
+    async def scenario():
+        scheduler = AdmissionScheduler(limit=1, priority_step=0.02)
+        order = []
+        hold = spawn(turn(scheduler, "hold", PRIORITY_SUMMARIZE, order, hold=0.1))
+        await asyncio.sleep(0)
+        old = spawn(turn(scheduler, "old new thread", PRIORITY_NEW_THREAD, order))
+        await asyncio.sleep(0.06)
+        fresh = spawn(turn(scheduler, "fresh summarize", PRIORITY_SUMMARIZE, order))
+        await asyncio.gather(hold, old, fresh)
+        return order
+
+    assert asyncio.run(scenario()) == ["hold", "old new thread", "fresh summarize"]
+
+
+def test_global_limit_covers_every_provider_and_hedge():
+    async def scenario():
+        scheduler = AdmissionScheduler(limit=2)
+        in_flight = InFlight()
+        first, second = FakeCompletions(0.05, in_flight), FakeCompletions(0.05, in_flight)
+        # Hedge after 10ms, so most calls fire a second request on the other provider
+        router = LLMRouter([FakeProvider("a", first), FakeProvider("b", second)], hedge_call_ms=10, scheduler=scheduler)
+        metadata = {}
+
+        async def call():
+            start_turn(PRIORITY_CONTINUE, metadata)
+            return await router.call([{"role": "user", "content": "hi"}], "model")
+
+        await asyncio.gather(*(spawn(call()) for _ in range(6)))
+        await asyncio.sleep(0.1)
+        return in_flight.peak, scheduler.stats(), metadata["queue_wait_ms"]
+
+    peak, stats, queue_wait_ms = asyncio.run(scenario())
+    assert peak <= 2
+    assert stats["active"] == 0 and stats["queued_total"] > 0
+    assert queue_wait_ms > 0
+
+
+def test_queued_call_with_fast_providers_does_not_hedge():
+    async def scenario():
+        scheduler = AdmissionScheduler(limit=1)
+        in_flight = InFlight()
+        first, second = FakeCompletions(0.02, in_flight), FakeCompletions(0.02, in_flight)
+        # Every call answers well within 100ms, but the last ones queue ~200ms for the single slot
+        router = LLMRouter([FakeProvider("a", first), FakeProvider("b", second)], hedge_call_ms=100, scheduler=scheduler)
+        calls = {"b": 0}
+        create = second.create
+
+        async def counted(*args, **kwargs):
+            calls["b"] += 1
+            return await create(*args, **kwargs)
+
+        second.create = counted
+
+        async def call():
+            start_turn(PRIORITY_CONTINUE, {})
+            return await router.call([{"role": "user", "content": "hi"}], "model")
+
+        await asyncio.gather(*(spawn(call()) for _ in range(10)))
+        return calls["b"], scheduler.stats()
+
+    hedged, stats = asyncio.run(scenario())
+    assert stats["queued_total"] > 0
+    assert hedged == 0
+
+
+def test_flow_priority():
+    assert flow_priority({}) == PRIORITY_NEW_THREAD
+    assert flow_priority({"extracted_message_count": 2}) == PRIORITY_CONTINUE
+    assert flow_priority({"complaint_topic": "Noise"}) == PRIORITY_CONTINUE
+    near_complete = {"complaint_topic": "Noise", "complaint_location": "Bishan", "complaint_summary": "Piling"}
+    assert flow_priority(near_complete) == PRIORITY_SUMMARIZE
@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+
+from broker import InMemoryBroker, RedisStreamBroker
+from coalesce import read_batch
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def redis_workers(count=2):
+    # Brokers sharing one fake Redis server, like workers sharing one Redis
+    server = fakeredis.FakeServer()
+    return [RedisStreamBroker(client=fakeredis.FakeAsyncRedis(server=server, decode_responses=True)) for _ in range(count)]
+
+
+async def read_all(reader):
+    text = ""
+    while True:
+        batch, ended, _ = await asyncio.wait_for(read_batch(reader, window_ms=0), 2)
+        text += batch
+        if ended:
+            return text
+
+
+def test_redis_attach_from_other_worker():
+    async def scenario():
+        publisher, subscriber = redis_workers()
+        metadata = {"complaint_topic": ""}
+        channel = publisher.channel("task_a", metadata, queue_size=8)
+        await channel.open()
+        assert await subscriber.attach("missing") is None
+        attached = await subscriber.attach("task_a")
+        reader = attached.reader()
+        for chunk in ("Where ", "did ", "it happen?"):
+            await channel.put(chunk)
+        # Set by the flow after the reader attached, only the end event carries it across
+        metadata["complaint_topic"] = "Construction noise"
+        await channel.put(None)
+        return await read_all(reader), reader.metadata, reader.error
+
+    assert asyncio.run(scenario()) == ("Where did it happen?", {"complaint_topic": "Construction noise"}, None)
+
+
+def test_redis_end_with_error():
+    async def scenario():
+        publisher, subscriber = redis_workers()
+        channel = publisher.channel("task_b", {}, queue_size=8)
+        await channel.open()
+        await channel.put("Partial")
+        await channel.end("failed")
+        # The flow's own end marker after that is a no-op
+        await channel.put(None)
+        reader = (await subscriber.attach("task_b")).reader()
+        return await read_all(reader), reader.error
+
+    assert asyncio.run(scenario()) == ("Partial", "failed")
+
+
+def test_redis_resume_from_entry_id():
+    async def scenario():
+        publisher, subscriber = redis_workers()
+        channel = publisher.channel("task_c", {}, queue_size=8)
+        await channel.open()
+        for chunk in ("one ", "two ", "three"):
+            await channel.put(chunk)
+        await channel.put(None)
+        attached = await subscriber.attach("task_c")
+        first = attached.reader()
+        assert await first.get() == "one "
+        # Reconnect with the Last-Event-ID of the first chunk
+        return await read_all(attached.reader(first.last_id))
+
+    assert asyncio.run(scenario()) == "two three"
+
+
+@pytest.mark.parametrize("last_event_id", ["abc", "1-x", "-1", ""])
+def test_redis_rejects_malformed_last_event_id(last_event_id):
+    publisher, = redis_workers(1)
+    assert publisher.channel("task_d", {}, queue_size=8).reader(last_event_id) is None
+
+
+def test_memory_rejects_unknown_last_event_id():
+    channel = InMemoryBroker().channel("task_e", {}, queue_size=8)
+    assert channel.reader("abc") is None
+    assert channel.reader("5") is None
+
+
+def test_redis_reader_keeps_its_connection_across_frames(monkeypatch):
+    # A cancelled XREAD makes redis-py disconnect, coalescing must not cancel reads once per frame
+    from redis.asyncio.connection import AbstractConnection
+
+    disconnects = []
+    disconnect = AbstractConnection.disconnect
+
+    async def counting_disconnect(self, *args, **kwargs):
+        disconnects.append(self)
+        return await disconnect(self, *args, **kwargs)
+
+    monkeypatch.setattr(AbstractConnection, "disconnect", counting_disconnect)
+
+    async def scenario():
+        publisher, subscriber = redis_workers()
+        channel = publisher.channel("task_f", {}, queue_size=8)
+        await channel.open()
+        reader = (await subscriber.attach("task_f")).reader()
+
+        async def publish():
+            for i in range(10):
+                await channel.put(f"chunk {i} ")
+                # Longer than the coalescing window, so every chunk is its own frame
+                await asyncio.sleep(0.04)
+            await channel.put(None)
+
+        publishing = asyncio.create_task(publish())
+        frames = []
+        while True:
+            text, ended, _ = await asyncio.wait_for(read_batch(reader, window_ms=20), 2)
+            frames.append(text)
+            if ended:
+                break
+        await publishing
+        return frames
+
+    frames = asyncio.run(scenario())
+    assert "".join(frames) == "".join(f"chunk {i} " for i in range(10))
+    assert len(frames) >= 5
+    assert disconnects == []
+
+
+def test_redis_resume_at_end_entry():
+    async def scenario():
+        publisher, subscriber = redis_workers()
+        channel = publisher.channel("task_g", {"complaint_topic": "Noise"}, queue_size=8)
+        await channel.open()
+        await channel.put("Where?")
+        await channel.put(None)
+        attached = await subscriber.attach("task_g")
+        first = attached.reader()
+        await read_all(first)
+        # Reconnect with the id of the end entry (what the metadata frame carries)
+        resumed = attached.reader(first.last_id)
+        return await read_all(resumed), resumed.metadata
+
+    assert asyncio.run(scenario()) == ("", {"complaint_topic": "Noise"})
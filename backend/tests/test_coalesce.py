@@ -0,0 +1,33 @@
+import asyncio
+import random
+
+from coalesce import ChunkCoalescer
+
+
+class SlowChannel:
+    # put() awaits, like RedisChannel's pipeline or a MemoryChannel under backpressure
+    def __init__(self, rng):
+        self.rng = rng
+        self.items = []
+
+    async def put(self, chunk):
+        await asyncio.sleep(self.rng.random() / 1000)
+        self.items.append(chunk)
+
+
+def test_end_marker_comes_after_every_batch():
+    async def scenario(seed):
+        rng = random.Random(seed)
+        channel = SlowChannel(rng)
+        out = ChunkCoalescer(channel, window_ms=1, max_chars=8)
+        chunks = [f"w{i} " for i in range(rng.randint(1, 12))]
+        for chunk in chunks:
+            await out.put(chunk)
+            await asyncio.sleep(rng.random() / 500)
+        await out.put(None)
+        return channel.items, "".join(chunks)
+
+    for seed in range(200):
+        items, text = asyncio.run(scenario(seed))
+        assert items[-1] is None and None not in items[:-1], seed
+        assert "".join(items[:-1]) == text, seed
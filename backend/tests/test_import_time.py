@@ -0,0 +1,15 @@
+import pytest
+
+from bench.import_time import LAZY_MODULES, import_profile
+
+
+@pytest.fixture(scope="module")
+def server_imports():
+    # A cold interpreter, so modules other tests imported don't hide an eager import
+    return import_profile("server")
+
+
+@pytest.mark.parametrize("module", LAZY_MODULES)
+def test_server_import_is_lazy(server_imports, module):
+    # Provider SDKs, Firestore, requests and tiktoken are imported on first use, not by `import server`
+    assert module not in server_imports
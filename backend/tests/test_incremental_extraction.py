@@ -0,0 +1,73 @@
+import asyncio
+import json
+
+import nodes
+from prompt_window import extraction_delta, history_hash
+
+HISTORY = [
+    {"role": "user", "content": "The piling works near my flat go on past 10pm"},
+    {"role": "assistant", "content": "Where is the construction site?"},
+    {"role": "user", "content": "Bishan street 22"},
+]
+
+
+def test_delta_after_new_messages():
+    grown = HISTORY + [{"role": "assistant", "content": "Since when?"}, {"role": "user", "content": "Since May"}]
+    assert extraction_delta(grown, 3, history_hash(HISTORY)) == grown[3:]
+
+
+def test_no_delta_when_last_message_edited():
+    # Editing the last message (or regenerating the reply) keeps the length the same
+    edited = HISTORY[:2] + [{"role": "user", "content": "Ang Mo Kio avenue 3"}]
+    assert extraction_delta(edited, 3, history_hash(HISTORY)) is None
+
+
+def test_no_delta_when_prefix_changed():
+    edited = [{"role": "user", "content": "Hawker centre is dirty"}] + HISTORY[1:] + [{"role": "user", "content": "Since May"}]
+    assert extraction_delta(edited, 3, history_hash(HISTORY)) is None
+
+
+def test_no_delta_without_hash_or_count():
+    grown = HISTORY + [{"role": "user", "content": "Since May"}]
+    assert extraction_delta(grown, 3, "") is None
+    assert extraction_delta(grown, 0, history_hash([])) is None
+
+
+class FakeCatalog:
+    version = 0
+
+    async def topic_names(self):
+        return ["Construction noise"]
+
+    async def match_topic(self, topic):
+        return topic
+
+
+def test_edited_message_reaches_the_prompt(monkeypatch):
+    prompts = []
+
+    async def call_llm_async(prompt, model=None):
+        prompts.append(prompt)
+        return json.dumps({"complaint_topic": "Construction noise", "complaint_location": "Ang Mo Kio", "complaint_summary": None,
+                           "complaint_quality": 3, "conversation_summary": "Piling noise in Ang Mo Kio"})
+
+    monkeypatch.setattr(nodes, "call_llm_async", call_llm_async)
+    monkeypatch.setattr(nodes, "topic_catalog", FakeCatalog())
+    monkeypatch.setattr(nodes, "INCREMENTAL_EXTRACTION", True)
+    edited = HISTORY[:2] + [{"role": "user", "content": "Ang Mo Kio avenue 3"}]
+    inputs = {
+        "conversation_history": edited,
+        "complaint_topic": "Construction noise",
+        "complaint_location": "Bishan",
+        "complaint_summary": "",
+        "complaint_quality": 3,
+        "conversation_summary": "Piling noise in Bishan",
+        "extracted_message_count": 3,
+        "extracted_prefix_hash": history_hash(HISTORY),
+    }
+    result = asyncio.run(nodes.HTTPDataExtractionNodeAsync().exec_async(inputs))
+
+    assert "Ang Mo Kio avenue 3" in prompts[0]
+    assert "New messages since the last extraction" not in prompts[0]
+    assert result["extracted_message_count"] == 3
+    assert result["extracted_prefix_hash"] == history_hash(edited)
@@ -0,0 +1,89 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import server
+from broker import InMemoryBroker, MemoryChannel
+from task_registry import TaskRegistry
+
+
+class SmallReplayBroker(InMemoryBroker):
+    def channel(self, task_id, metadata, queue_size):
+        return MemoryChannel(task_id, metadata, queue_size, replay_size=2)
+
+
+def frames(body):
+    # [(event id or None, payload)]
+    parsed = []
+    for block in body.strip().split("\n\n"):
+        event_id = None
+        for line in block.split("\n"):
+            if line.startswith("id: "):
+                event_id = line[4:]
+            elif line.startswith("data: "):
+                parsed.append((event_id, json.loads(line[6:])))
+    return parsed
+
+
+async def finished_task(registry, task_id, chunks):
+    entry = registry.create(task_id, {"complaint_topic": "Construction noise"})
+    reader = entry.channel.reader()
+    for chunk in chunks + [None]:
+        await entry.channel.put(chunk)
+        # Keep up with the flow so backpressure never blocks it
+        await reader.get()
+    return entry
+
+
+async def get_stream(task_id, last_event_id=None):
+    headers = {"Last-Event-ID": last_event_id} if last_event_id else {}
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await asyncio.wait_for(client.get(f"/api/chat/stream/{task_id}", headers=headers), 2)
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = TaskRegistry(SmallReplayBroker(), queue_size=2)
+    monkeypatch.setattr(server, "task_registry", registry)
+    return registry
+
+
+def test_resume_mid_stream(registry):
+    async def scenario():
+        await finished_task(registry, "task_a", ["one ", "two ", "three"])
+        return await get_stream("task_a", "2")
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 200
+    parsed = frames(response.text)
+    assert [payload["content"] for _, payload in parsed if "content" in payload] == ["three"]
+    assert parsed[-2][1]["threadMetaData"] == {"complaint_topic": "Construction noise"}
+    assert parsed[-1][1] == {"done": True}
+
+
+def test_resume_at_end_marker(registry):
+    # A client that dropped after the metadata frame reconnects with that frame's id (the end marker)
+    async def scenario():
+        await finished_task(registry, "task_b", ["one ", "two"])
+        first = frames((await get_stream("task_b")).text)
+        # The first read released the task, put it back as if that client had dropped before `done`
+        await finished_task(registry, "task_c", ["one ", "two"])
+        return first, await get_stream("task_c", first[-2][0])
+
+    first, response = asyncio.run(scenario())
+    assert first[-2][0] == "3"
+    parsed = frames(response.text)
+    assert [payload for _, payload in parsed if "content" in payload] == []
+    assert parsed[-2][1]["type"] == "metadata"
+    assert parsed[-1][1] == {"done": True}
+
+
+def test_resume_from_evicted_id_is_gone(registry):
+    async def scenario():
+        await finished_task(registry, "task_d", ["one ", "two ", "three ", "four"])
+        return await get_stream("task_d", "1")
+
+    assert asyncio.run(scenario()).status_code == 410
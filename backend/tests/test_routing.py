@@ -0,0 +1,71 @@
+import pytest
+
+from routing import (
+    CONTINUE,
+    NEEDS_EXTRACTION,
+    REJECT,
+    SUMMARIZE,
+    complaint_threshold,
+    missing_fields,
+    parse_quality,
+    route_after_extraction,
+    route_thread,
+)
+
+FIELDS = {"complaint_topic": "Construction noise", "complaint_location": "Bishan", "complaint_summary": "Piling past 10pm"}
+
+
+def thread(quality, **overrides):
+    return {**FIELDS, "complaint_quality": quality, **overrides}
+
+
+def test_threshold_is_four():
+    # The cases below are written against this value
+    assert complaint_threshold == 4
+
+
+@pytest.mark.parametrize("value, expected", [
+    (5, 5), ("5", 5), ("4.0", 4), (3.7, 3), (None, 0), ("", 0), ("high", 0),
+])
+def test_parse_quality(value, expected):
+    assert parse_quality(value) == expected
+
+
+@pytest.mark.parametrize("quality, on_arrival, after_extraction", [
+    (3, NEEDS_EXTRACTION, CONTINUE),
+    # At the threshold the quality still counts as missing: the thread is extracted again,
+    # it used to be rejected without ever being summarized
+    (4, NEEDS_EXTRACTION, CONTINUE),
+    (5, REJECT, SUMMARIZE),
+])
+def test_threshold_edges(quality, on_arrival, after_extraction):
+    assert route_thread(thread(quality)) == on_arrival
+    assert route_after_extraction(thread(quality)) == after_extraction
+
+
+@pytest.mark.parametrize("quality, on_arrival, after_extraction", [
+    ("5", REJECT, SUMMARIZE),
+    ("4", NEEDS_EXTRACTION, CONTINUE),
+    (None, NEEDS_EXTRACTION, CONTINUE),
+])
+def test_string_and_null_quality(quality, on_arrival, after_extraction):
+    assert route_thread(thread(quality)) == on_arrival
+    assert route_after_extraction(thread(quality)) == after_extraction
+
+
+def test_quality_at_threshold_is_missing():
+    assert missing_fields(thread(4)) == ["complaint_quality"]
+    assert missing_fields(thread(5)) == []
+
+
+@pytest.mark.parametrize("field", sorted(FIELDS))
+def test_missing_field_at_quality_five(field):
+    metadata = thread(5, **{field: ""})
+    assert missing_fields(metadata) == [field]
+    assert route_thread(metadata) == NEEDS_EXTRACTION
+    assert route_after_extraction(metadata) == CONTINUE
+
+
+def test_empty_thread():
+    assert missing_fields({}) == ["complaint_topic", "complaint_location", "complaint_summary", "complaint_quality"]
+    assert route_thread({}) == NEEDS_EXTRACTION
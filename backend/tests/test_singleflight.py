@@ -0,0 +1,128 @@
+import asyncio
+
+import httpx
+import pytest
+from starlette.requests import Request
+
+import server
+from broker import InMemoryBroker
+from canned_responses import FLOW_FAILED
+from task_registry import TaskRegistry
+from test_resume import frames
+
+TURN = {"messages": [{"role": "user", "content": "The piling works near my flat go on past 10pm"}], "threadMetaData": {}}
+
+
+class FakeFlow:
+    # Streams a fixed answer, or fails before streaming anything
+    runs = 0
+    fail = False
+
+    async def run_async(self, shared):
+        FakeFlow.runs += 1
+        if FakeFlow.fail:
+            raise RuntimeError("provider down")
+        for chunk in ("Where ", "is ", "it?"):
+            await shared["message_queue"].put(chunk)
+        await shared["message_queue"].put(None)
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    FakeFlow.runs = 0
+    FakeFlow.fail = False
+    registry = TaskRegistry(InMemoryBroker())
+    monkeypatch.setattr(server, "task_registry", registry)
+    monkeypatch.setattr(server, "generate_or_summarize_flow", FakeFlow)
+    return registry
+
+
+async def post(client):
+    # The ASGI transport returns once the background flow has run
+    response = await client.post("/api/chat", json=TURN)
+    return response.json()["task_id"]
+
+
+async def read(client, task_id):
+    response = await asyncio.wait_for(client.get(f"/api/chat/stream/{task_id}"), 2)
+    parsed = [payload for _, payload in frames(response.text)]
+    text = "".join(payload["content"] for payload in parsed if "content" in payload)
+    error = next((payload["error"] for payload in parsed if "error" in payload), None)
+    return text, error
+
+
+def run(scenario):
+    async def with_client():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await scenario(client)
+    return asyncio.run(with_client())
+
+
+def test_two_subscribers_get_the_full_stream(registry):
+    async def scenario(client):
+        first, second = await post(client), await post(client)
+        first_read = await read(client, first)
+        # Still there for the second subscriber
+        live_after_first = first in registry
+        second_read = await read(client, second)
+        return first, second, first_read, second_read, live_after_first, first in registry
+
+    first, second, first_read, second_read, live_after_first, live_after_last = run(scenario)
+    assert first == second
+    assert first_read == second_read == ("Where is it?", None)
+    assert live_after_first and not live_after_last
+    assert FakeFlow.runs == 1
+    assert registry.coalesced_total == 1
+
+
+def test_retry_replays_without_new_flow(registry):
+    async def scenario(client):
+        task_id = await post(client)
+        await post(client)
+        # One subscriber has its answer, the other is still pending when the retry comes in
+        await read(client, task_id)
+        retry = await post(client)
+        return task_id, retry, await read(client, retry)
+
+    task_id, retry, retry_read = run(scenario)
+    assert retry == task_id
+    assert retry_read == ("Where is it?", None)
+    assert FakeFlow.runs == 1
+
+
+def test_dropped_reader_keeps_task_for_retry(registry):
+    async def scenario(client):
+        task_id = await post(client)
+        # Reader goes away after the first frame, without releasing its subscription
+        request = Request({"type": "http", "method": "GET", "path": "/", "headers": [], "query_string": b""})
+        response = await server.stream_endpoint(request, task_id, last_event_id=None)
+        await response.body_iterator.__anext__()
+        await response.body_iterator.aclose()
+        retry = await post(client)
+        return task_id, retry, await read(client, retry)
+
+    task_id, retry, retry_read = run(scenario)
+    assert retry == task_id
+    assert retry_read == ("Where is it?", None)
+    assert FakeFlow.runs == 1
+
+
+def test_failed_flow_is_not_reused(registry):
+    async def scenario(client):
+        FakeFlow.fail = True
+        failed = await post(client)
+        # A retry while the failed task is still waiting for its reader gets a fresh flow
+        FakeFlow.fail = False
+        retry = await post(client)
+        failed_read = await read(client, failed)
+        retry_read = await read(client, retry)
+        # And once every reader is done, nothing of the failed task is left
+        return failed, retry, failed_read, retry_read, failed in registry, len(registry._inflight)
+
+    failed, retry, failed_read, retry_read, failed_live, inflight = run(scenario)
+    assert retry != failed
+    assert failed_read == ("", FLOW_FAILED)
+    assert retry_read == ("Where is it?", None)
+    assert not failed_live and inflight == 0
+    assert FakeFlow.runs == 2
@@ -0,0 +1,59 @@
+import asyncio
+
+import server
+from broker import InMemoryBroker
+from canned_responses import FLOW_FAILED, TASK_EXPIRED
+from coalesce import read_batch
+from task_registry import TaskRegistry
+
+
+def test_reap_ends_connected_reader():
+    async def scenario():
+        registry = TaskRegistry(InMemoryBroker(), queue_size=4, ttl=0)
+        entry = registry.create("task_a", {})
+        reader = entry.channel.reader()
+        pending = asyncio.ensure_future(read_batch(reader))
+        await asyncio.sleep(0)
+        assert await registry.reap() == ["task_a"]
+        text, ended, _ = await asyncio.wait_for(pending, 1)
+        return text, ended, reader.error, "task_a" in registry
+
+    assert asyncio.run(scenario()) == ("", True, TASK_EXPIRED, False)
+
+
+def test_end_skips_backpressure():
+    async def scenario():
+        registry = TaskRegistry(InMemoryBroker(), queue_size=2)
+        channel = registry.create("task_b", {}).channel
+        await channel.put("a")
+        await channel.put("b")
+        # Queue is full and nobody reads, end() must still return
+        await asyncio.wait_for(channel.end(TASK_EXPIRED), 1)
+        # A second end (or the flow's own put(None)) doesn't add another marker
+        await channel.end(FLOW_FAILED)
+        reader = channel.reader()
+        return [await reader.get() for _ in range(3)], reader.error
+
+    assert asyncio.run(scenario()) == (["a", "b", None], TASK_EXPIRED)
+
+
+class FailingFlow:
+    async def run_async(self, shared):
+        raise RuntimeError("provider down")
+
+
+def test_failed_flow_ends_stream_with_error(monkeypatch):
+    monkeypatch.setattr(server, "generate_or_summarize_flow", FailingFlow)
+
+    async def scenario():
+        registry = TaskRegistry(InMemoryBroker())
+        monkeypatch.setattr(server, "task_registry", registry)
+        entry = registry.create("task_c", {})
+        reader = entry.channel.reader()
+        await server.run_flow({"task_id": "task_c", "priority": 1})
+        return await asyncio.wait_for(reader.get(), 1), reader.error, entry.metadata
+
+    chunk, error, metadata = asyncio.run(scenario())
+    assert chunk is None
+    assert error == FLOW_FAILED
+    assert metadata["queue_wait_ms"] == 0
@@ -0,0 +1,82 @@
+import asyncio
+
+import persistence
+from topic_catalog import TopicCatalog
+
+
+class FakeWatch:
+    def __init__(self):
+        self.is_active = True
+        self.unsubscribed = False
+
+    def unsubscribe(self):
+        self.unsubscribed = True
+
+
+def fake_firestore(monkeypatch, topics):
+    calls = {"loads": 0, "watches": []}
+
+    async def list_topics(collection):
+        calls["loads"] += 1
+        return [dict(topic) for topic in topics]
+
+    async def watch_collection(collection, callback):
+        watch = FakeWatch()
+        calls["watches"].append(watch)
+        return watch
+
+    async def create_topic(data, collection):
+        topics.append(data)
+
+    monkeypatch.setattr(persistence, "list_topics", list_topics)
+    monkeypatch.setattr(persistence, "watch_collection", watch_collection)
+    monkeypatch.setattr(persistence, "create_topic", create_topic)
+    return calls
+
+
+class Doc:
+    def __init__(self, data):
+        self.data = data
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+def test_version_only_moves_when_names_change(monkeypatch):
+    topics = [{"topic": "Construction noise", "summary": "Piling", "imageURL": ""}]
+    fake_firestore(monkeypatch, topics)
+
+    async def scenario():
+        catalog = TopicCatalog()
+        await catalog.get_topics()
+        versions = [catalog.version]
+        # Unrelated field edited
+        catalog._on_snapshot([Doc({**topics[0], "summary": "Piling at night"})], [], None)
+        versions.append(catalog.version)
+        # Write-through, then the listener echoing the same write
+        await catalog.add_topic("Public transport")
+        versions.append(catalog.version)
+        catalog._on_snapshot([Doc(topic) for topic in topics], [], None)
+        versions.append(catalog.version)
+        # A topic deleted elsewhere
+        catalog._on_snapshot([Doc(topics[1])], [], None)
+        versions.append(catalog.version)
+        return versions
+
+    assert asyncio.run(scenario()) == [1, 1, 2, 2, 3]
+
+
+def test_stopped_listener_falls_back_to_ttl(monkeypatch):
+    calls = fake_firestore(monkeypatch, [{"topic": "Construction noise"}])
+
+    async def scenario():
+        catalog = TopicCatalog(ttl=0)
+        await catalog.get_topics()
+        await catalog.get_topics()
+        loads_while_watching = calls["loads"]
+        calls["watches"][0].is_active = False
+        await catalog.get_topics()
+        return loads_while_watching, calls["loads"], calls["watches"][0].unsubscribed, len(calls["watches"])
+
+    # Reloaded once the watch stopped, and a new listener attached
+    assert asyncio.run(scenario()) == (1, 2, True, 2)
@@ -0,0 +1,125 @@
+# topic_catalog.py
+import asyncio
+import os
+import threading
+import time
+
+import persistence
+from log import get_logger
+from topic_matcher import TopicMatcher
+
+logger = get_logger("topic_catalog")
+
+DEFAULT_TOPIC_IMAGE = "https://firebasestorage.googleapis.com/v0/b/complainsg-b0b10.firebasestorage.app/o/Default_Cuphead.png?alt=media"
+
+# How long a loaded catalog is trusted when there is no snapshot listener keeping it fresh
+TOPIC_CACHE_TTL = float(os.environ.get("TOPIC_CACHE_TTL", "300"))
+
+
+class TopicCatalog:
+    """
+    In-process cache of the 'topics' collection.
+    The catalog is loaded once and then kept fresh by a Firestore on_snapshot listener,
+    so reading topics on the chat hot path does not touch Firestore.
+    If the listener can't be attached (or watch=False) it falls back to reloading every `ttl` seconds.
+    """
+
+    def __init__(self, collection="topics", ttl=TOPIC_CACHE_TTL, watch=True):
+        self.collection = collection
+        self.ttl = ttl
+        self.watch = watch
+        # Bumped when the set of topic names changes, so other caches can key on it
+        self.version = 0
+        self._topics = None
+        self._names = frozenset()
+        self._loaded_at = 0.0
+        self._watcher = None
+        # Fuzzy index over the topic names, rebuilt when the version moves on
+        self._matcher = None
+        self._matcher_version = -1
+        # Guards _topics against the Firestore watch thread
+        self._lock = threading.Lock()
+        # Makes concurrent cache misses share a single load
+        self._load_lock = asyncio.Lock()
+
+    def _is_fresh(self):
+        if self._topics is None:
+            return False
+        # Listener pushes every change to us, no need to expire while it is still streaming
+        if self._watcher is not None:
+            if getattr(self._watcher, "is_active", True):
+                return True
+            logger.warning("❌ TOPIC CATALOG: Snapshot listener stopped, falling back to TTL reloads")
+            self.close()
+        return time.monotonic() - self._loaded_at < self.ttl
+
+    def _replace(self, topics):
+        # Echoes of our own write-through and edits to summary/imageURL leave the names (and version) alone
+        names = frozenset(topic.get("topic") for topic in topics if topic.get("topic"))
+        with self._lock:
+            self._topics = topics
+            self._loaded_at = time.monotonic()
+            if names != self._names:
+                self._names = names
+                self.version += 1
+
+    def _on_snapshot(self, docs, changes, read_time):
+        # Called from the Firestore watch thread with the full collection state
+        self._replace([doc.to_dict() for doc in docs])
+
+    async def _start_watch(self):
+        try:
+            self._watcher = await persistence.watch_collection(self.collection, self._on_snapshot)
+        except Exception as e:
+            logger.warning("❌ TOPIC CATALOG: Failed to attach snapshot listener, falling back to TTL polling: %s", e)
+            self._watcher = None
+
+    async def load(self):
+        topics = await persistence.list_topics(self.collection)
+        self._replace(topics)
+        logger.info("📚 TOPIC CATALOG: Loaded %d topics (version %d)", len(topics), self.version)
+        return topics
+
+    async def get_topics(self):
+        if not self._is_fresh():
+            async with self._load_lock:
+                # Another coroutine may have loaded it while we waited
+                if not self._is_fresh():
+                    await self.load()
+                    if self.watch and self._watcher is None:
+                        await self._start_watch()
+        return list(self._topics)
+
+    async def topic_names(self):
+        return [topic["topic"] for topic in await self.get_topics() if topic.get("topic")]
+
+    async def match_topic(self, topic):
+        # Existing topic that `topic` is a near-duplicate of ("Noise from construction" -> "Construction noise"), or None
+        names = await self.topic_names()
+        if self._matcher is None or self._matcher_version != self.version:
+            self._matcher = TopicMatcher(names)
+            self._matcher_version = self.version
+        return self._matcher.match(topic)
+
+    async def add_topic(self, topic, summary="", image_url=DEFAULT_TOPIC_IMAGE):
+        new_topic_data = {
+            "topic": topic,
+            "summary": summary,
+            "imageURL": image_url,
+        }
+        await persistence.create_topic(new_topic_data, self.collection)
+        # Write-through so the next turn sees the topic without waiting for the listener
+        with self._lock:
+            if self._topics is not None and all(t.get("topic") != topic for t in self._topics):
+                self._topics = self._topics + [new_topic_data]
+                self._names = self._names | {topic}
+                self.version += 1
+        return new_topic_data
+
+    def close(self):
+        if self._watcher is not None:
+            self._watcher.unsubscribe()
+            self._watcher = None
+
+
+topic_catalog = TopicCatalog()
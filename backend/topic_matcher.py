@@ -0,0 +1,110 @@
+# topic_matcher.py
+# Fuzzy matching of topic names, so "Noise from construction", "Construction noises" and
+# "Constrution noise" all land on the existing "Construction noise" topic instead of each
+# becoming a new topics document.
+# Names are normalized to an order-insensitive token key, then compared as sets of character
+# trigrams (Dice coefficient) through an inverted index, so a lookup only touches topics that
+# share at least one trigram with the query.
+import os
+import re
+from collections import Counter, defaultdict
+
+# Minimum trigram similarity (0-1) for two topic names to count as the same topic
+TOPIC_MATCH_THRESHOLD = float(os.environ.get("TOPIC_MATCH_THRESHOLD", "0.8"))
+
+STOPWORDS = {"a", "an", "and", "at", "by", "for", "from", "in", "of", "on", "or", "the", "to", "with"}
+
+
+def normalize_tokens(name):
+    tokens = []
+    for token in re.findall(r"[a-z0-9]+", name.lower()):
+        if token in STOPWORDS:
+            continue
+        # Cheap singular form: "noises" -> "noise", but leave "glass", "bus"
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def topic_key(name):
+    # Word order doesn't matter: "noise construction" == "construction noise"
+    return " ".join(sorted(set(normalize_tokens(name))))
+
+
+def trigrams(key):
+    grams = set()
+    for token in key.split():
+        padded = f"  {token} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TopicMatcher:
+    def __init__(self, names=(), threshold=TOPIC_MATCH_THRESHOLD):
+        self.threshold = threshold
+        self.names = []
+        self._features = []
+        # Normalized key -> first topic name with that key
+        self._by_key = {}
+        # Trigram -> indexes of the names containing it
+        self._index = defaultdict(list)
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        key = topic_key(name)
+        position = len(self.names)
+        features = trigrams(key)
+        self.names.append(name)
+        self._features.append(features)
+        self._by_key.setdefault(key, name)
+        for gram in features:
+            self._index[gram].append(position)
+        return position
+
+    def scores(self, features):
+        # Sparse dot product: shared trigram counts with every indexed name that has any
+        shared = Counter()
+        for gram in features:
+            shared.update(self._index.get(gram, ()))
+        for position, count in shared.items():
+            yield position, 2 * count / (len(features) + len(self._features[position]))
+
+    def best(self, name):
+        key = topic_key(name)
+        if key in self._by_key:
+            return self._by_key[key], 1.0
+        best_name, best_score = None, 0.0
+        for position, score in self.scores(trigrams(key)):
+            if score > best_score:
+                best_name, best_score = self.names[position], score
+        return best_name, best_score
+
+    def match(self, name):
+        # Existing topic that `name` is a near-duplicate of, or None
+        best_name, score = self.best(name)
+        return best_name if score >= self.threshold else None
+
+    def clusters(self):
+        """Groups of indexed names that are near-duplicates of each other (transitively), largest first."""
+        parent = list(range(len(self.names)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for position, features in enumerate(self._features):
+            for other, score in self.scores(features):
+                if other != position and score >= self.threshold:
+                    parent[find(other)] = find(position)
+
+        groups = defaultdict(list)
+        for position in range(len(self.names)):
+            groups[find(position)].append(position)
+        return sorted(groups.values(), key=len, reverse=True)
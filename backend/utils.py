@@ -1,13 +1,33 @@
 import os 
-import anthropic 
-import requests
+import time
 import json
 from dotenv import load_dotenv
-from openai import AsyncOpenAI
+from llm_clients import get_anthropic
+from llm_router import LLM_BASE_URL, llm_router
+from log import get_logger, sampled
+from metrics import LLM_COMPLETION_TOKENS, LLM_DURATION, LLM_PROMPT_TOKENS, LLM_TTFT, add_span
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = get_logger("llm")
+
+# tiktoken is optional, without it token counts are estimated from the text length.
+# Its encoding is loaded on first use rather than at import (it's slow to load).
+_token_encoding = None
+_token_encoding_loaded = False
+
+def _encoding():
+    global _token_encoding, _token_encoding_loaded
+    if not _token_encoding_loaded:
+        _token_encoding_loaded = True
+        try:
+            import tiktoken
+            _token_encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _token_encoding = None
+    return _token_encoding
+
 # Models
 QWEN_THINKING = "qwen/qwen3-235b-a22b-thinking-2507"
 QWEN_30B = "qwen/qwen3-30b-a3b:free"
@@ -18,9 +38,9 @@ def call_llm(prompt):
     anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
     qwen_api_key = os.getenv("QWEN_30B")
     if not (anthropic_api_key or qwen_api_key):
-        raise ValueError("Neither ANTHROPIC_API_KEY nor QWEN3_FREE environment variable is set.")
-    elif anthropic_api_key:
-        client = anthropic.Anthropic(api_key=anthropic_api_key)
+        raise ValueError("Neither ANTHROPIC_API_KEY nor QWEN_30B environment variable is set.")
+    if anthropic_api_key:
+        client = get_anthropic(anthropic_api_key)
         messages = [{"role": "user", "content": prompt}]
         message = client.messages.create(
             model=CLAUDE_SONNET,
@@ -29,61 +49,103 @@ def call_llm(prompt):
         )
         return message.content[0].text
     # qwen fallback
-    elif qwen_api_key:
-        url = "https://openrouter.ai/api/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {qwen_api_key}",
-            "Content-Type": "application/json"
+    import requests
+    url = f"{LLM_BASE_URL}/chat/completions"
+    headers = {
+        "Authorization": f"Bearer {qwen_api_key}",
+        "Content-Type": "application/json"
     }
     data = {
-        "model": "qwen/qwen3-30b-a3b:free",
+        "model": QWEN_30B,
         "messages": [
             {"role": "user", "content": prompt}
         ],
         "max_tokens": 1024,
     }
-    response = requests.post(url, headers=headers, json=data)
+    response = requests.post(url, headers=headers, json=data, timeout=60)
     response.raise_for_status()
     
     return response.json()["choices"][0]["message"]["content"]
 
-async def stream_llm_async(
-    messages,
-    model=ARCEE_SPOTLIGHT,
-    api_key=os.environ.get("QWEN_30B"),
-    base_url="https://openrouter.ai/api/v1",
-):
-    client = AsyncOpenAI(
-        base_url=base_url,
-        api_key=api_key,
-    )
+def count_tokens(text):
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return max(1, len(text) // 4) if text else 0
+
+def truncate_tokens(text, max_tokens):
+    # Keep roughly the first max_tokens tokens of text
+    encoding = _encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text)
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * 4]
+
+def record_llm_call(kind, model, started, first_token_at, usage, messages, completion):
+    # Token counts come from the provider's usage block when it sends one, otherwise they are estimated
+    duration = time.perf_counter() - started
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or count_tokens(format_messages(messages))
+    completion_tokens = getattr(usage, "completion_tokens", None) or count_tokens(completion)
+    LLM_DURATION.observe(duration, kind=kind, model=model)
+    LLM_PROMPT_TOKENS.observe(prompt_tokens, kind=kind, model=model)
+    LLM_COMPLETION_TOKENS.observe(completion_tokens, kind=kind, model=model)
+    span = {"model": model, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+    if first_token_at is not None:
+        ttft = first_token_at - started
+        LLM_TTFT.observe(ttft, model=model)
+        span["ttft_ms"] = round(ttft * 1000, 2)
+    add_span(f"llm.{kind}", duration, **span)
+
+def format_message(message):
+    return f"{message.get('role', 'user')}: {message.get('content', '')}"
+
+def format_messages(messages):
+    # Compact "role: content" transcript, much smaller than the repr of the message dicts
+    return "\n".join(format_message(message) for message in messages)
+
+async def stream_llm_async(messages, model=ARCEE_SPOTLIGHT, router=llm_router):
+    # The router picks (and if it's slow, hedges / fails over between) the configured providers
+    started = time.perf_counter()
+    first_token_at = None
+    usage = None
+    completion = ""
     
-    stream = await client.chat.completions.create(
-        model=model,
-        messages=messages,
-        stream=True,
+    stream = router.stream(
+        messages,
+        model,
         temperature=0.7,
         extra_body={"max_tokens": 1024},
+        # Final chunk carries token usage (and no choices)
+        stream_options={"include_usage": True},
     )
-    print('Beginning stream with prompt: ', messages)
+    logger.debug("Beginning stream with prompt: %s", messages)
     
-    async for chunk in stream:
-        if chunk.choices[0].delta.content is not None:
-            yield chunk.choices[0].delta.content
+    try:
+        async for chunk in stream:
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content is not None:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                completion += chunk.choices[0].delta.content
+                yield chunk.choices[0].delta.content
+    finally:
+        # Gives the provider slot back straight away if our consumer stopped early
+        await stream.aclose()
+        record_llm_call("stream", model, started, first_token_at, usage, messages, completion)
 
-async def call_llm_async(prompt, model=QWEN_30B, api_key=os.environ.get("QWEN_30B"), base_url="https://openrouter.ai/api/v1"):
+async def call_llm_async(prompt, model=QWEN_30B, router=llm_router):
     messages = [{"role": "user", "content": prompt}]    
-    client = AsyncOpenAI(
-        base_url=base_url,
-        api_key=api_key,
-    )
-    response = await client.chat.completions.create(
-        model=model,
-        messages=messages,
+    started = time.perf_counter()
+    response = await router.call(
+        messages,
+        model,
         temperature=0.7,
         extra_body={"max_tokens": 1024},
     )
-    return response.choices[0].message.content
+    content = response.choices[0].message.content
+    record_llm_call("call", model, started, None, response.usage, messages, content or "")
+    return content
 
 async def socket_send(websocket, type, content):
     await websocket.send_text(json.dumps({"type": type, "content": content}))
@@ -101,12 +163,13 @@ async def socket_loop(prompt, websocket):
             if chunk_content == "":
                 continue
             full_response += chunk_content
-            print(f"chunk_content: {chunk_content}")
+            if sampled():
+                logger.debug("chunk_content: %s", chunk_content)
             await socket_send(websocket, "chunk", chunk_content)
         
         # Check if response is empty or just whitespace
         if full_response.strip():
-            print(f"stream_complete: {full_response}")
+            logger.debug("stream_complete: %s", full_response)
             await socket_send(websocket, "stream_complete", full_response)
             return full_response
         
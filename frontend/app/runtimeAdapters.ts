@@ -135,6 +135,14 @@ export function createMessageAdapter(
             summary: item.data.threadMetaData["complaint_summary"] || "",
             location: item.data.threadMetaData["complaint_location"] || "",
             quality: item.data.threadMetaData["complaint_quality"] || 0,
+            // Lets the backend only extract from messages added since the last turn
+            conversationSummary:
+              item.data.threadMetaData["conversation_summary"] || "",
+            extractedMessageCount:
+              item.data.threadMetaData["extracted_message_count"] || 0,
+            // Lets the backend check those messages weren't edited since
+            extractedPrefixHash:
+              item.data.threadMetaData["extracted_prefix_hash"] || "",
           };
 
           console.log("xx [RUN] metadata", metaDataObj);
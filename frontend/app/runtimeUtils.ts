@@ -22,20 +22,23 @@ export async function* parseSSEStream(response: Response) {
           if (line.startsWith("data: ")) {
             const jsonPart = line.slice(6);
   
+            let data;
             try {
-              const data = JSON.parse(jsonPart);
-  
-              if (data.content) {
-                yield { type: "content", data: data.content };
-              } else if (data.type === "metadata") {
-                yield { type: "metadata", data: data };
-              } else if (data.done) {
-                return;
-              } else if (data.error) {
-                throw new Error(data.error);
-              }
+              data = JSON.parse(jsonPart);
             } catch (e) {
               // Ignore parse errors
+              continue;
+            }
+
+            if (data.content) {
+              yield { type: "content", data: data.content };
+            } else if (data.type === "metadata") {
+              yield { type: "metadata", data: data };
+            } else if (data.done) {
+              return;
+            } else if (data.error) {
+              // Failed or expired task: thrown outside the parse try so the chat shows it
+              throw new Error(data.error);
             }
           }
         }
@@ -44,6 +44,9 @@ export type ThreadMetaData = Record<string, {
   summary: string;
   location: string;
   quality: number;
+  conversationSummary?: string;
+  extractedMessageCount?: number;
+  extractedPrefixHash?: string;
 }>;
 
 export type MessageRole = "user" | "assistant" | "system" | "data";